@@ -1,6 +1,6 @@
 import os
 from fastapi import APIRouter, Header, Query, Body, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from typing import Dict, Any, List, Optional
 import uuid
 import time
@@ -13,23 +13,26 @@ from api.utils.llm_utils import (
     generate_chat_response,
     rebuild_chat_session,
 )
-from api.utils.chat_utils import ChatHistoryManager, ChatMessage
+from api.utils.chat_utils import AsyncChatHistoryManager, ChatMessage
 
 
 # Define Router
 router = APIRouter()
 
 # Initialize chat history manager and sessions
-chat_manager = ChatHistoryManager(model="llm-agent")
+chat_manager = AsyncChatHistoryManager(model="llm-agent")
 
 
 @router.get("/chats")
 async def get_chats(
-    x_session_id: str = Header(None, alias="X-Session-ID"), limit: Optional[int] = None
+    x_session_id: str = Header(None, alias="X-Session-ID"),
+    limit: Optional[int] = None,
+    offset: int = 0,
 ):
     """Get all chats, optionally limited to a specific number"""
     print("x_session_id:", x_session_id)
-    return chat_manager.get_recent_chats(x_session_id, limit)
+    chats = await chat_manager.get_recent_chats(x_session_id, limit, offset)
+    return ORJSONResponse(chats)
 
 
 @router.get("/chats/{chat_id}")
@@ -38,7 +41,7 @@ async def get_chat(
 ):
     """Get a specific chat by ID"""
     print("x_session_id:", x_session_id)
-    chat = chat_manager.get_chat(chat_id, x_session_id)
+    chat = await chat_manager.get_chat(chat_id, x_session_id)
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
-    return chat
+    return ORJSONResponse(chat)
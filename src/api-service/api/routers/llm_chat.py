@@ -1,35 +1,42 @@
-import os
-from fastapi import APIRouter, Header, Query, Body, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Header, Query, Body, HTTPException, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from typing import Dict, Any, List, Optional
 import uuid
 import time
 from datetime import datetime
-import mimetypes
 
-from pathlib import Path
 from api.utils.llm_utils import (
     chat_sessions,
     create_chat_session,
     generate_chat_response,
+    generate_chat_response_stream,
     rebuild_chat_session,
 )
-from api.utils.chat_utils import ChatHistoryManager, ChatMessage
+from api.utils.http_cache import IMMUTABLE_CACHE_CONTROL, cached_file_response
+from api.utils.chat_utils import (
+    AsyncChatHistoryManager,
+    ChatMessage,
+    SSE_HEADERS,
+    stream_chat_response,
+)
 
 # Define Router
 router = APIRouter()
 
 # Initialize chat history manager and sessions
-chat_manager = ChatHistoryManager(model="llm")
+chat_manager = AsyncChatHistoryManager(model="llm")
 
 
 @router.get("/chats")
 async def get_chats(
-    x_session_id: str = Header(None, alias="X-Session-ID"), limit: Optional[int] = None
+    x_session_id: str = Header(None, alias="X-Session-ID"),
+    limit: Optional[int] = None,
+    offset: int = 0,
 ):
     """Get all chats, optionally limited to a specific number"""
     print("x_session_id:", x_session_id)
-    return chat_manager.get_recent_chats(x_session_id, limit)
+    chats = await chat_manager.get_recent_chats(x_session_id, limit, offset)
+    return ORJSONResponse(chats)
 
 
 @router.get("/chats/{chat_id}")
@@ -38,10 +45,10 @@ async def get_chat(
 ):
     """Get a specific chat by ID"""
     print("x_session_id:", x_session_id)
-    chat = chat_manager.get_chat(chat_id, x_session_id)
+    chat = await chat_manager.get_chat(chat_id, x_session_id)
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
-    return chat
+    return ORJSONResponse(chat)
 
 
 @router.post("/chats")
@@ -55,16 +62,15 @@ async def start_chat_with_llm(
     chat_id = str(uuid.uuid4())
     current_time = int(time.time())
 
-    # Create a new chat session
+    # Create a new chat session, cached once the first turn is saved
     chat_session = create_chat_session()
-    chat_sessions[chat_id] = chat_session
 
     # Add ID and role to the user message
     message_dict["message_id"] = str(uuid.uuid4())
     message_dict["role"] = "user"
 
     # Generate response
-    assistant_response = generate_chat_response(chat_session, message_dict)
+    assistant_response = await generate_chat_response(chat_session, message_dict)
 
     # Create chat response
     title = message_dict.get("content")
@@ -86,10 +92,56 @@ async def start_chat_with_llm(
     }
 
     # Save chat
-    chat_manager.save_chat(chat_response, x_session_id)
+    await chat_manager.save_chat(chat_response, x_session_id)
+    chat_sessions[chat_id] = chat_session
     return chat_response
 
 
+@router.post("/chats/stream")
+async def start_chat_with_llm_stream(
+    message: ChatMessage, x_session_id: str = Header(None, alias="X-Session-ID")
+):
+    """Start a new chat with an initial message, streaming the reply as server-sent events"""
+    message_dict = message.model_dump()
+    print("content:", message_dict["content"])
+    print("x_session_id:", x_session_id)
+    chat_id = str(uuid.uuid4())
+    current_time = int(time.time())
+
+    # Create a new chat session, cached once the first turn is saved
+    chat_session = create_chat_session()
+
+    # Add ID and role to the user message
+    message_dict["message_id"] = str(uuid.uuid4())
+    message_dict["role"] = "user"
+
+    # Create chat
+    title = message_dict.get("content")
+    if title == "":
+        title = "Image chat"
+    title = title[:50] + "..."
+    chat = {
+        "chat_id": chat_id,
+        "title": title,
+        "dts": current_time,
+        "messages": [],
+    }
+
+    return StreamingResponse(
+        stream_chat_response(
+            chat,
+            chat_session,
+            message_dict,
+            x_session_id,
+            chat_manager,
+            generate_chat_response_stream,
+            chat_sessions,
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
 @router.post("/chats/{chat_id}")
 async def continue_chat_with_llm(
     chat_id: str,
@@ -100,7 +152,7 @@ async def continue_chat_with_llm(
     print("content:", message_dict["content"])
     print("x_session_id:", x_session_id)
     """Add a message to an existing chat"""
-    chat = chat_manager.get_chat(chat_id, x_session_id)
+    chat = await chat_manager.get_chat(chat_id, x_session_id)
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
 
@@ -119,25 +171,71 @@ async def continue_chat_with_llm(
     message_dict["role"] = "user"
 
     # Generate response
-    assistant_response = generate_chat_response(chat_session, message_dict)
+    assistant_response = await generate_chat_response(chat_session, message_dict)
 
     # Add messages
-    chat["messages"].append(message_dict)
-    chat["messages"].append(
+    new_messages = [
+        message_dict,
         {
             "message_id": str(uuid.uuid4()),
             "role": "assistant",
             "content": assistant_response,
-        }
-    )
+        },
+    ]
+    chat["messages"].extend(new_messages)
+
+    # Append the new turn to the saved chat
+    await chat_manager.append_messages(chat_id, x_session_id, new_messages, current_time)
+    # Store the session again so the cache measures its grown history
+    chat_sessions[chat_id] = chat_session
+    return ORJSONResponse(chat)
 
-    # Save updated chat
-    chat_manager.save_chat(chat, x_session_id)
-    return chat
+
+@router.post("/chats/{chat_id}/stream")
+async def continue_chat_with_llm_stream(
+    chat_id: str,
+    message: ChatMessage,
+    x_session_id: str = Header(None, alias="X-Session-ID"),
+):
+    """Add a message to an existing chat, streaming the reply as server-sent events"""
+    message_dict = message.model_dump()
+    print("content:", message_dict["content"])
+    print("x_session_id:", x_session_id)
+    chat = await chat_manager.get_chat(chat_id, x_session_id)
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    # Get or rebuild chat session
+    chat_session = chat_sessions.get(chat_id)
+    if not chat_session:
+        chat_session = rebuild_chat_session(chat["messages"])
+        chat_sessions[chat_id] = chat_session
+
+    # Update timestamp
+    current_time = int(time.time())
+    chat["dts"] = current_time
+
+    # Add message ID and role
+    message_dict["message_id"] = str(uuid.uuid4())
+    message_dict["role"] = "user"
+
+    return StreamingResponse(
+        stream_chat_response(
+            chat,
+            chat_session,
+            message_dict,
+            x_session_id,
+            chat_manager,
+            generate_chat_response_stream,
+            chat_sessions,
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
 
 
 @router.get("/images/{chat_id}/{message_id}.png")
-async def get_chat_image(chat_id: str, message_id: str):
+async def get_chat_image(chat_id: str, message_id: str, request: Request):
     """
     Serve an image from the chat history.
 
@@ -146,29 +244,24 @@ async def get_chat_image(chat_id: str, message_id: str):
         message_id: The message ID
 
     Returns:
-        FileResponse: The image file with appropriate content type
+        Response: The image file with appropriate content type and caching headers,
+        or 304 Not Modified if the client already has it
     """
     try:
-        # Construct the image path
-        image_path = os.path.join(chat_manager.images_dir, chat_id, f"{message_id}.png")
-
-        # Verify the path exists and is within the images directory
-        image_path = Path(image_path).resolve()
-        images_dir = Path(chat_manager.images_dir).resolve()
-
-        # Security check: ensure the requested file is within the images directory
-        if not str(image_path).startswith(str(images_dir)):
-            raise HTTPException(status_code=403, detail="Access denied")
-
-        if not image_path.exists():
+        # Look up the image, images identical across messages are stored once
+        image = await chat_manager.get_image(chat_id, message_id)
+        if image is None:
             raise HTTPException(status_code=404, detail="Image not found")
-
-        # Determine content type
-        content_type, _ = mimetypes.guess_type(str(image_path))
-        if not content_type:
-            content_type = "application/octet-stream"
-
-        return FileResponse(path=image_path, media_type=content_type)
+        image_path, content_type, image_hash = image
+
+        # Images never change once saved, so they can be cached indefinitely
+        return cached_file_response(
+            request,
+            image_path,
+            media_type=content_type,
+            etag=image_hash,
+            cache_control=IMMUTABLE_CACHE_CONTROL,
+        )
 
     except HTTPException:
         raise
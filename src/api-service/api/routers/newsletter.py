@@ -1,10 +1,11 @@
 import os
-from fastapi import APIRouter, Query, Body, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Query, Body, HTTPException, Request
+from fastapi.responses import ORJSONResponse, Response
 from typing import Dict, Any, Optional
-import glob
-import json
-import traceback
+import mimetypes
+
+from api.utils.catalog import Catalog
+from api.utils.http_cache import cached_file_response
 
 # Define Router
 router = APIRouter()
@@ -13,42 +14,52 @@ router = APIRouter()
 # We will assume the Newsletters have already been downloaded into "news-letters" folder locally
 data_folder = "news-letters"
 
+# Documents are served from memory and reloaded when files in the folder change
+catalog = Catalog(data_folder, detail_fields=["detail"], precompress=True)
+
 @router.get("/")
-async def get_newsletters(limit: Optional[int] = None):
-    """Get all newsletters, optionally limited to a specific number"""
-    newsletters = []
-    data_files = glob.glob(os.path.join(data_folder,"*.json"))
-    for filepath in data_files:
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                chat_data = json.load(f)        
-                newsletters.append(chat_data)
-        except Exception as e:
-            print(f"Error loading chat history from {filepath}: {str(e)}")
-            traceback.print_exc()
-
-    # Sort by dts
-    newsletters.sort(key=lambda x: x.get('dts', 0), reverse=True)
-    if limit:
-        return newsletters[:limit]
-
-    return newsletters
+async def get_newsletters(
+    limit: Optional[int] = None,
+    before_dts: Optional[int] = Query(None, description="Only return newsletters older than this dts, pass the dts of the last item to get the next page"),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. id,title,dts"),
+    summary: bool = Query(False, description="Leave out the full text of each item"),
+):
+    """Get all newsletters newest first, optionally limited to a specific number"""
+    items = await catalog.list(
+        limit,
+        before_dts=before_dts,
+        fields=[field.strip() for field in fields.split(",") if field.strip()] if fields else None,
+        summary=summary
+    )
+    return ORJSONResponse(items)
 
 @router.get("/{newsletter_id}")
-async def get_newsletter(newsletter_id: str):
+async def get_newsletter(newsletter_id: str, request: Request):
     """Get a specific ID"""
-    filepath = os.path.join(data_folder,f"{newsletter_id}.json")
-    with open(filepath, 'r', encoding='utf-8') as f:
-        newsletter = json.load(f) 
+    newsletter = await catalog.get(newsletter_id)
     if not newsletter:
-        raise HTTPException(status_code=404, detail="Chat not found")
-    return newsletter
+        raise HTTPException(status_code=404, detail="Newsletter not found")
+
+    # Send the gzipped copy made when the newsletter was loaded, if the client accepts it
+    gzipped = await catalog.get_gzipped(newsletter_id)
+    if gzipped is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(
+            content=gzipped,
+            media_type="application/json",
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+        )
+    return ORJSONResponse(newsletter)
 
 @router.get("/image/{image_name}")
-async def get_newsletter_image(image_name: str):
-    content_type = "application/octet-stream"
+async def get_newsletter_image(image_name: str, request: Request):
+    """Serve a newsletter image with caching headers"""
     image_path = os.path.join(data_folder,"assets",image_name)
-    return FileResponse(
-        path=image_path,
-        media_type=content_type
-    )
\ No newline at end of file
+    if not os.path.isfile(image_path):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    content_type, _ = mimetypes.guess_type(image_path)
+    return cached_file_response(
+        request,
+        image_path,
+        media_type=content_type or "application/octet-stream"
+    )
@@ -1,10 +1,11 @@
 import os
-from fastapi import APIRouter, Query, Body, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Query, Body, HTTPException, Request
+from fastapi.responses import ORJSONResponse
 from typing import Dict, Any, Optional
-import glob
-import json
-import traceback
+from urllib.parse import quote
+
+from api.utils.catalog import Catalog
+from api.utils.http_cache import cached_file_response
 
 # Define Router
 router = APIRouter()
@@ -13,56 +14,59 @@ router = APIRouter()
 # We will assume the Podcasts have already been downloaded into "podcasts" folder locally
 data_folder = "podcasts"
 
-@router.get("/")
-async def get_podcasts(limit: Optional[int] = None):
-    """Get all podcasts, optionally limited to a specific number"""
-    podcasts = []
-    data_files = glob.glob(os.path.join(data_folder,"*.json"))
-    for filepath in data_files:
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                chat_data = json.load(f)        
-                podcasts.append(chat_data)
-        except Exception as e:
-            print(f"Error loading podcasts from {filepath}: {str(e)}")
-            traceback.print_exc()
-
-    # Sort by dts
-    podcasts.sort(key=lambda x: x.get('dts', 0), reverse=True)
-    if limit:
-        return podcasts[:limit]
+# Documents are served from memory and reloaded when files in the folder change
+catalog = Catalog(data_folder)
 
-    return podcasts
+@router.get("/")
+async def get_podcasts(
+    limit: Optional[int] = None,
+    before_dts: Optional[int] = Query(None, description="Only return podcasts older than this dts, pass the dts of the last item to get the next page"),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. id,title,dts"),
+    summary: bool = Query(False, description="Leave out the detail fields of each item"),
+):
+    """Get all podcasts newest first, optionally limited to a specific number"""
+    items = await catalog.list(
+        limit,
+        before_dts=before_dts,
+        fields=[field.strip() for field in fields.split(",") if field.strip()] if fields else None,
+        summary=summary
+    )
+    return ORJSONResponse(items)
 
 @router.get("/{podcast_id}")
 async def get_podcast(podcast_id: str):
     """Get a specific ID"""
-    filepath = os.path.join(data_folder,f"{podcast_id}.json")
-    with open(filepath, 'r', encoding='utf-8') as f:
-        podcast = json.load(f) 
+    podcast = await catalog.get(podcast_id)
     if not podcast:
         raise HTTPException(status_code=404, detail="Podcast not found")
-    return podcast
+    return ORJSONResponse(podcast)
 
 @router.get("/audio/{audio_name}")
-async def get_podcast_audio(audio_name: str):
+async def get_podcast_audio(audio_name: str, request: Request):
     """
-    Serve the MP3 file for a specific podcast episode
+    Serve the MP3 file for a specific podcast episode.
+    Supports Range requests (single and multiple ranges, with If-Range) answered
+    with 206 Partial Content, so players can seek without downloading the whole
+    episode. The file is sent in chunks, or zero-copy by servers that support
+    the ASGI pathsend extension.
     """
     try:
         # Construct the file path - adjust the file naming convention as needed
         audio_path = os.path.join(data_folder,"assets",audio_name)
         
-        if not os.path.exists(audio_path):
+        if not os.path.isfile(audio_path):
             raise HTTPException(status_code=404, detail="Podcast audio not found")
-            
-        return FileResponse(
+
+        # Inline so browsers play the episode instead of downloading it
+        return cached_file_response(
+            request,
             audio_path,
             media_type="audio/mpeg",
             headers={
-                "Accept-Ranges": "bytes",
-                "Content-Disposition": f"attachment; filename={audio_name}"
+                "Content-Disposition": f"inline; filename*=utf-8''{quote(audio_name)}"
             }
         )
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,19 +1,31 @@
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
 
 from api.routers import newsletter, podcast
 
 from api.routers import llm_chat, llm_cnn_chat
 from api.routers import llm_rag_chat, llm_agent_chat
+from api.utils import llm_cnn_utils, llm_rag_utils
 
 # from api.routers import test_router
+from api.utils.chat_storage import flush_chat_storage
+from api.utils.compression import CompressionMiddleware
 
 # Set root_path based on environment
 ROOT_PATH = os.getenv("ROOT_PATH", "")
 
 # Setup FastAPI app
-api_app = FastAPI(title="API Server", description="API Server", version="v1")
+# Serialise responses with orjson
+api_app = FastAPI(
+    title="API Server",
+    description="API Server",
+    version="v1",
+    default_response_class=ORJSONResponse,
+)
 
 # Enable CORSMiddleware
 api_app.add_middleware(
@@ -25,6 +37,10 @@ api_app.add_middleware(
 )
 
 
+# Compress large JSON responses
+api_app.add_middleware(CompressionMiddleware)
+
+
 # Routes
 @api_app.get("/")
 async def get_index():
@@ -36,6 +52,42 @@ async def get_api_status():
     return {"version": "1.0.1"}
 
 
+@api_app.get("/status/session-cache")
+async def get_session_cache_status():
+    return {
+        "llm": llm_chat.chat_sessions.stats(),
+        "llm-cnn": llm_cnn_chat.chat_sessions.stats(),
+        "llm-rag": llm_rag_chat.chat_sessions.stats(),
+    }
+
+
+@api_app.get("/status/vector-db")
+async def get_vector_db_status():
+    return await run_in_threadpool(llm_rag_utils.collection.health)
+
+
+@api_app.get("/status/cnn-model")
+async def get_cnn_model_status():
+    # Readiness of the CNN behind /llm-cnn, 503 until it has loaded
+    status = llm_cnn_utils.cnn_loader.status()
+    return ORJSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@api_app.get("/status/cnn-batcher")
+async def get_cnn_batcher_status():
+    return llm_cnn_utils.cnn_batcher.stats()
+
+
+@api_app.get("/status/embedding-cache")
+async def get_embedding_cache_status():
+    return llm_rag_utils.query_embedding_cache.stats()
+
+
+@api_app.get("/status/response-cache")
+async def get_response_cache_status():
+    return llm_rag_utils.response_cache.stats()
+
+
 # Additional routers here
 api_app.include_router(newsletter.router, prefix="/newsletters")
 api_app.include_router(podcast.router, prefix="/podcasts")
@@ -45,6 +97,22 @@ api_app.include_router(llm_rag_chat.router, prefix="/llm-rag")
 api_app.include_router(llm_agent_chat.router, prefix="/llm-agent")
 # app.include_router(test_router.router, prefix="/test")
 
+
+# Lifespan events only run on the top level app, not on mounted apps
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the newsletter and podcast catalogs before serving requests
+    newsletter.catalog.load()
+    podcast.catalog.load()
+    # Load the CNN in the background, only /llm-cnn image requests wait for it
+    llm_cnn_utils.cnn_loader.start()
+    yield
+    # Write out any buffered chat history before shutting down
+    flush_chat_storage()
+
+
 # Mount your API under ROOT-PATH to match the Ingress rule
-app = FastAPI(title="API Server", description="API Server", version="v1")
+app = FastAPI(
+    title="API Server", description="API Server", version="v1", lifespan=lifespan
+)
 app.mount(ROOT_PATH, api_app)
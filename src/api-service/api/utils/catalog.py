@@ -0,0 +1,196 @@
+import bisect
+import json
+import os
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import orjson
+from fastapi.concurrency import run_in_threadpool
+
+from api.utils.compression import gzip_compress
+
+# How often the data folder is checked for added, changed or removed files
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "5"))
+# Field projections kept per catalog version, others are built per request
+MAX_CACHED_PROJECTIONS = 32
+
+
+class CatalogView:
+    """One version of a catalog's documents, sorted by dts, with its list projections"""
+
+    def __init__(
+        self,
+        documents: Dict[str, Dict],
+        detail_fields: Tuple[str, ...],
+        precompress: bool = False,
+    ):
+        # Sort by dts
+        self.items = sorted(
+            documents.values(), key=lambda x: x.get("dts", 0), reverse=True
+        )
+        self.summaries = [
+            {key: value for key, value in item.items() if key not in detail_fields}
+            for item in self.items
+        ]
+        # Negated dts of the items, ascending, for cursor lookups
+        self.dts_keys = [-item.get("dts", 0) for item in self.items]
+        # Sorted field names -> items projected to those fields
+        self._projections: Dict[Tuple[str, ...], List[Dict]] = {}
+        # Document id -> gzipped JSON of the document, encoded like ORJSONResponse
+        self.gzipped: Dict[str, bytes] = {}
+        if precompress:
+            self.gzipped = {
+                document_id: gzip_compress(orjson.dumps(document))
+                for document_id, document in documents.items()
+            }
+
+    def project(self, fields: Sequence[str]) -> List[Dict]:
+        """Get the items projected to the given fields, building it on first use"""
+        key = tuple(sorted(set(fields)))
+        projection = self._projections.get(key)
+        if projection is None:
+            projection = [
+                {field: item[field] for field in key if field in item}
+                for item in self.items
+            ]
+            if len(self._projections) < MAX_CACHED_PROJECTIONS:
+                self._projections[key] = projection
+        return projection
+
+
+class Catalog:
+    """
+    In-memory catalog of the JSON documents in a data folder (newsletters, podcasts).
+
+    Documents are loaded once and kept sorted by dts, newest first, so listing is
+    a slice and lookups by id are a dict access. The folder is rescanned at most
+    every refresh_seconds, and only files whose mtime or size changed are parsed
+    again.
+
+    List projections are built once per catalog version: summaries leave out the
+    detail_fields (e.g. the full newsletter text), and projections to a set of
+    requested fields are cached the first time they are asked for. With precompress,
+    each document's JSON is also gzipped once per version for get_gzipped.
+    """
+
+    def __init__(
+        self,
+        data_folder: str,
+        detail_fields: Sequence[str] = (),
+        precompress: bool = False,
+        refresh_seconds: float = CATALOG_REFRESH_SECONDS,
+    ):
+        self.data_folder = data_folder
+        self.detail_fields = tuple(detail_fields)
+        self.precompress = precompress
+        self.refresh_seconds = refresh_seconds
+        # filename -> (mtime_ns, size, document)
+        self._files: Dict[str, tuple] = {}
+        self._by_id: Dict[str, Dict] = {}
+        # Replaced as a whole on reload, so a request never mixes two versions
+        self._view = CatalogView({}, self.detail_fields)
+        self._checked_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """Scan the data folder and update the catalog with any changed files"""
+        with self._lock:
+            try:
+                entries = {
+                    entry.name: entry.stat()
+                    for entry in os.scandir(self.data_folder)
+                    if entry.name.endswith(".json") and entry.is_file()
+                }
+            except FileNotFoundError:
+                entries = {}
+
+            changed = entries.keys() != self._files.keys()
+            files = {}
+            for filename, stat_result in entries.items():
+                previous = self._files.get(filename)
+                if previous is not None and previous[:2] == (
+                    stat_result.st_mtime_ns,
+                    stat_result.st_size,
+                ):
+                    files[filename] = previous
+                    continue
+
+                filepath = os.path.join(self.data_folder, filename)
+                try:
+                    with open(filepath, "r", encoding="utf-8") as f:
+                        document = json.load(f)
+                except Exception as e:
+                    # Possibly a file that is still being written, retry on the next scan
+                    print(f"Error loading {filepath}: {str(e)}")
+                    traceback.print_exc()
+                    if previous is not None:
+                        files[filename] = previous
+                    continue
+                files[filename] = (stat_result.st_mtime_ns, stat_result.st_size, document)
+                changed = True
+
+            if changed:
+                self._files = files
+                self._by_id = {
+                    filename[: -len(".json")]: document
+                    for filename, (_, _, document) in files.items()
+                }
+                self._view = CatalogView(
+                    self._by_id, self.detail_fields, self.precompress
+                )
+            self._checked_at = time.monotonic()
+
+    async def refresh(self) -> None:
+        """Rescan the data folder if it has not been checked recently"""
+        if (
+            self._checked_at is None
+            or time.monotonic() - self._checked_at >= self.refresh_seconds
+        ):
+            await run_in_threadpool(self.load)
+
+    async def list(
+        self,
+        limit: Optional[int] = None,
+        before_dts: Optional[float] = None,
+        fields: Optional[Sequence[str]] = None,
+        summary: bool = False,
+    ) -> List[Dict]:
+        """
+        Get documents newest first.
+
+        Args:
+            limit: Maximum number of documents to return
+            before_dts: Cursor, only return documents older than this dts
+            fields: Only return these fields of each document
+            summary: Leave out the detail fields of each document
+
+        Returns:
+            List[Dict]: The documents, or their projections
+        """
+        await self.refresh()
+        view = self._view
+        if fields:
+            items = view.project(fields)
+        elif summary:
+            items = view.summaries
+        else:
+            items = view.items
+
+        start = 0
+        if before_dts is not None:
+            start = bisect.bisect_right(view.dts_keys, -before_dts)
+        if limit:
+            return items[start : start + limit]
+        return items[start:]
+
+    async def get(self, document_id: str) -> Optional[Dict]:
+        """Get a specific document by ID"""
+        await self.refresh()
+        return self._by_id.get(document_id)
+
+    async def get_gzipped(self, document_id: str) -> Optional[bytes]:
+        """Get the precompressed JSON of a document, None if not precompressed"""
+        await self.refresh()
+        return self._view.gzipped.get(document_id)
@@ -0,0 +1,629 @@
+import os
+import glob
+from abc import ABC, abstractmethod
+import heapq
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+from typing import Any, Dict, List, Optional, Union
+
+import orjson
+
+# Storage backend for chat history, "file" or "sqlite"
+CHAT_STORAGE_BACKEND = os.getenv("CHAT_STORAGE_BACKEND", "file")
+
+# Delay before buffered chat writes are flushed to disk, 0 writes immediately
+CHAT_WRITE_BEHIND_SECONDS = float(os.getenv("CHAT_WRITE_BEHIND_SECONDS", "0"))
+
+# Per-session index of chat summaries, kept next to the chat files
+INDEX_FILENAME = "index.json"
+
+# SQLite database file, kept in the model's chat history directory
+SQLITE_FILENAME = "chats.db"
+
+# Number of striped locks used to serialise writes to the same chat
+LOCK_STRIPES = 64
+
+
+def dumps_json(obj: Any) -> str:
+    """Serialise chat data to compact JSON with orjson"""
+    return orjson.dumps(obj).decode("utf-8")
+
+
+def loads_json(data: Union[str, bytes]) -> Any:
+    """Deserialise chat data with orjson, raises json.JSONDecodeError on bad input"""
+    return orjson.loads(data)
+
+
+def chat_summary(chat: Dict) -> Dict:
+    """Summary of a chat as returned by chat listings"""
+    return {
+        "chat_id": chat["chat_id"],
+        "title": chat.get("title"),
+        "dts": chat.get("dts", 0),
+        "message_count": len(chat.get("messages", [])),
+    }
+
+
+def atomic_write(path: str, data: Union[str, bytes]) -> None:
+    """
+    Write a file atomically: write to a temporary file in the same directory,
+    fsync it and rename it over the target, so readers and crashes never see a
+    partially written file.
+    """
+    mode = "wb" if isinstance(data, bytes) else "w"
+    encoding = None if isinstance(data, bytes) else "utf-8"
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def append_durable(path: str, text: str) -> None:
+    """Append text to a file and fsync it"""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class WriteBehindBuffer:
+    """
+    Buffers file writes and appends in memory and flushes them from a background
+    thread after a delay, so a burst of writes to the same file is coalesced into
+    a single write and fsync. Reads through the buffer see the pending data, and
+    the data being flushed until it is on disk.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._lock = threading.Lock()
+        # path -> [replacement content or None to keep the file on disk, appended text]
+        self._pending: Dict[str, list] = {}
+        # Entries taken by the running flush, layered under _pending until written
+        self._flushing: Dict[str, list] = {}
+        # One flush at a time, and reads never see a file half way through its flush
+        self._flush_lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._flusher = None
+
+    def write(self, path: str, text: str) -> None:
+        with self._lock:
+            # A full rewrite supersedes any pending appends
+            self._pending[path] = [text, []]
+            self._start_flusher()
+
+    def append(self, path: str, text: str) -> None:
+        with self._lock:
+            self._pending.setdefault(path, [None, []])[1].append(text)
+            self._start_flusher()
+
+    def has_pending(self, path: str) -> bool:
+        with self._lock:
+            return path in self._pending or path in self._flushing
+
+    def read(self, path: str) -> str:
+        """Read a file including its pending writes"""
+        # Hold the I/O lock so an entry is not both written to disk and layered on it
+        with self._io_lock:
+            with self._lock:
+                layers = [
+                    (entry[0], list(entry[1]))
+                    for entry in (self._flushing.get(path), self._pending.get(path))
+                    if entry is not None
+                ]
+            if not layers:
+                with open(path, "r", encoding="utf-8") as f:
+                    return f.read()
+
+            content, appends = None, []
+            for layer_content, layer_appends in layers:
+                if layer_content is not None:
+                    content, appends = layer_content, []
+                appends.extend(layer_appends)
+            if content is None:
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        content = f.read()
+                except FileNotFoundError:
+                    content = ""
+        return content + "".join(appends)
+
+    def flush(self) -> None:
+        """Write all pending data to disk, data that fails to write stays pending"""
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+                entries = list(self._flushing.items())
+            for path, (content, appends) in entries:
+                with self._io_lock:
+                    try:
+                        if content is not None:
+                            atomic_write(path, content + "".join(appends))
+                        elif appends:
+                            append_durable(path, "".join(appends))
+                        failed = False
+                    except Exception as e:
+                        print(f"Error flushing chat history to {path}: {str(e)}")
+                        traceback.print_exc()
+                        failed = True
+                    with self._lock:
+                        del self._flushing[path]
+                        if failed:
+                            self._requeue(path, content, appends)
+
+    def _requeue(self, path: str, content: Optional[str], appends: List[str]) -> None:
+        """Put an entry that failed to flush back under the writes made since"""
+        newer = self._pending.get(path)
+        if newer is None:
+            self._pending[path] = [content, appends]
+        elif newer[0] is None:
+            # Newer appends go after the failed data, a newer rewrite supersedes it
+            self._pending[path] = [content, appends + newer[1]]
+
+    def _start_flusher(self) -> None:
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._run, daemon=True)
+            self._flusher.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.delay)
+            self.flush()
+
+
+# Shared by all file backends so one thread flushes every model's chat history
+write_behind = (
+    WriteBehindBuffer(CHAT_WRITE_BEHIND_SECONDS)
+    if CHAT_WRITE_BEHIND_SECONDS > 0
+    else None
+)
+
+
+def flush_chat_storage() -> None:
+    """Flush buffered chat history writes, called on shutdown"""
+    if write_behind is not None:
+        write_behind.flush()
+
+
+class ChatStorage(ABC):
+    """Interface for the chat history storage backends"""
+
+    @abstractmethod
+    def save_chat(self, chat: Dict, session_id: str) -> None:
+        """Save a chat, its images must already have been replaced with paths"""
+
+    @abstractmethod
+    def get_chat(self, chat_id: str, session_id: str) -> Optional[Dict]:
+        """Get a specific chat by ID, including all messages"""
+
+    @abstractmethod
+    def list_chats(
+        self, session_id: str, limit: Optional[int] = None, offset: int = 0
+    ) -> List[Dict]:
+        """Get chat summaries for a session, most recent first"""
+
+    @abstractmethod
+    def append_messages(
+        self, chat_id: str, session_id: str, messages: List[Dict], dts: int
+    ) -> None:
+        """Append new messages to an existing chat and update its timestamp"""
+
+    def compact_chat(self, chat_id: str, session_id: str) -> None:
+        """Rewrite a chat's stored representation in its most compact form"""
+        pass
+
+
+class FileChatStorage(ChatStorage):
+    """
+    Stores each chat under <history_dir>/<session_id>/ as a small JSON header
+    <chat_id>.json (chat_id, title, dts) and an append-only JSONL message log
+    <chat_id>.jsonl, so a new turn only appends its messages to the log.
+
+    Chats saved before the message log existed keep their messages inside the
+    header file; they are compacted into a header and log on their next append.
+
+    Files are replaced atomically and writes to the same chat (and to the same
+    session index) are serialised with striped locks. When CHAT_WRITE_BEHIND_SECONDS
+    is set, writes go through the shared write-behind buffer.
+    """
+
+    def __init__(self, history_dir: str, buffer: Optional[WriteBehindBuffer] = None):
+        self.history_dir = history_dir
+        self.buffer = buffer
+        self._chat_locks = [threading.RLock() for _ in range(LOCK_STRIPES)]
+        self._index_locks = [threading.RLock() for _ in range(LOCK_STRIPES)]
+        # Message logs known to end with a complete line
+        self._verified_logs = set()
+
+    def _chat_lock(self, chat_id: str, session_id: str) -> threading.RLock:
+        return self._chat_locks[hash((session_id, chat_id)) % LOCK_STRIPES]
+
+    def _index_lock(self, session_id: str) -> threading.RLock:
+        return self._index_locks[hash(session_id) % LOCK_STRIPES]
+
+    def _get_chat_filepath(self, chat_id: str, session_id: str) -> str:
+        """Get the full file path for a chat JSON header file"""
+        return os.path.join(self.history_dir, session_id, f"{chat_id}.json")
+
+    def _get_log_filepath(self, chat_id: str, session_id: str) -> str:
+        """Get the full file path for a chat's JSONL message log"""
+        return os.path.join(self.history_dir, session_id, f"{chat_id}.jsonl")
+
+    def _get_index_filepath(self, session_id: str) -> str:
+        """Get the full file path for a session's chat index"""
+        return os.path.join(self.history_dir, session_id, INDEX_FILENAME)
+
+    def _read_file(self, path: str) -> str:
+        if self.buffer is not None:
+            return self.buffer.read(path)
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def _write_file(self, path: str, text: str) -> None:
+        if self.buffer is not None:
+            self.buffer.write(path, text)
+        else:
+            atomic_write(path, text)
+
+    def _append_file(self, path: str, text: str) -> None:
+        if self.buffer is not None:
+            self.buffer.append(path, text)
+        else:
+            append_durable(path, text)
+
+    def _load_index(self, session_id: str) -> Dict[str, Dict]:
+        """Load the chat index for a session, building it from the chat files if missing"""
+        index_path = self._get_index_filepath(session_id)
+        try:
+            return loads_json(self._read_file(index_path))
+        except FileNotFoundError:
+            return self._rebuild_index(session_id)
+        except Exception as e:
+            print(f"Error loading chat index from {index_path}: {str(e)}")
+            traceback.print_exc()
+            return self._rebuild_index(session_id)
+
+    def _write_index(self, session_id: str, index: Dict[str, Dict]) -> None:
+        """Write the chat index for a session"""
+        self._write_file(self._get_index_filepath(session_id), dumps_json(index))
+
+    def _update_index(self, session_id: str, chat_id: str, update) -> None:
+        """Apply an update to a chat's index entry under the session index lock"""
+        with self._index_lock(session_id):
+            index = self._load_index(session_id)
+            index[chat_id] = update(index.get(chat_id))
+            self._write_index(session_id, index)
+
+    def _rebuild_index(self, session_id: str) -> Dict[str, Dict]:
+        """Build the chat index for a session by scanning its chat files"""
+        chat_dir = os.path.join(self.history_dir, session_id)
+        os.makedirs(chat_dir, exist_ok=True)
+        index = {}
+        with self._index_lock(session_id):
+            for filepath in glob.glob(os.path.join(chat_dir, "*.json")):
+                if os.path.basename(filepath) == INDEX_FILENAME:
+                    continue
+                chat_id = os.path.basename(filepath)[: -len(".json")]
+                # Read without the chat lock, writers take it before the index lock
+                chat_data = self._read_chat(chat_id, session_id)
+                if chat_data:
+                    index[chat_data["chat_id"]] = chat_summary(chat_data)
+
+            self._write_index(session_id, index)
+        return index
+
+    def _write_header(self, chat: Dict, session_id: str) -> None:
+        """Write the chat header, everything but the messages"""
+        header = {key: value for key, value in chat.items() if key != "messages"}
+        self._write_file(
+            self._get_chat_filepath(chat["chat_id"], session_id),
+            dumps_json(header),
+        )
+
+    def _read_header(self, chat_id: str, session_id: str) -> Dict:
+        """Read a chat's header, without any messages kept in it"""
+        filepath = self._get_chat_filepath(chat_id, session_id)
+        header = {"chat_id": chat_id}
+        try:
+            header.update(loads_json(self._read_file(filepath)))
+        except Exception as e:
+            print(f"Error loading chat header from {filepath}: {str(e)}")
+        header.pop("messages", None)
+        return header
+
+    def _read_log(self, chat_id: str, session_id: str) -> Optional[List[Dict]]:
+        """Read the messages from a chat's message log, None if it has no log"""
+        messages = []
+        try:
+            lines = self._read_file(self._get_log_filepath(chat_id, session_id))
+        except FileNotFoundError:
+            return None
+
+        # JSON strings cannot contain raw newlines, so the log parses as one array
+        try:
+            return loads_json("[" + lines.rstrip("\n").replace("\n", ",") + "]")
+        except orjson.JSONDecodeError:
+            pass
+        for line in lines.splitlines():
+            try:
+                messages.append(loads_json(line))
+            except orjson.JSONDecodeError:
+                # A partially written last line, dropped on compaction
+                print(f"Skipping corrupt message in chat {chat_id}")
+        return messages
+
+    def _log_is_appendable(self, chat_id: str, session_id: str) -> bool:
+        """Check the message log exists and ends with a complete line"""
+        log_path = self._get_log_filepath(chat_id, session_id)
+        if log_path in self._verified_logs or (
+            self.buffer is not None and self.buffer.has_pending(log_path)
+        ):
+            return True
+        try:
+            with open(log_path, "rb") as f:
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        return False
+        except FileNotFoundError:
+            return False
+        self._verified_logs.add(log_path)
+        return True
+
+    def save_chat(self, chat: Dict, session_id: str) -> None:
+        chat_dir = os.path.join(self.history_dir, session_id)
+        os.makedirs(chat_dir, exist_ok=True)
+
+        with self._chat_lock(chat["chat_id"], session_id):
+            # Save the message log and the header
+            log_path = self._get_log_filepath(chat["chat_id"], session_id)
+            self._write_file(
+                log_path,
+                "".join(dumps_json(message) + "\n" for message in chat["messages"]),
+            )
+            self._verified_logs.add(log_path)
+            self._write_header(chat, session_id)
+
+        # Update the session index
+        self._update_index(session_id, chat["chat_id"], lambda _: chat_summary(chat))
+
+    def append_messages(
+        self, chat_id: str, session_id: str, messages: List[Dict], dts: int
+    ) -> None:
+        with self._chat_lock(chat_id, session_id):
+            # Chats saved before the message log existed, or whose log ends in a
+            # partially written line, are compacted first
+            if not self._log_is_appendable(chat_id, session_id):
+                self.compact_chat(chat_id, session_id)
+
+            # Append the new messages to the log
+            self._append_file(
+                self._get_log_filepath(chat_id, session_id),
+                "".join(dumps_json(message) + "\n" for message in messages),
+            )
+
+            # Update the session index and the header's timestamp, keeping the
+            # header's title and any other fields
+            header = self._read_header(chat_id, session_id)
+            header["dts"] = dts
+
+            def update(summary):
+                if summary is None:
+                    # Missing from the index, count the messages now in the log
+                    summary = chat_summary(
+                        {**header, "messages": self._read_log(chat_id, session_id) or []}
+                    )
+                else:
+                    summary["message_count"] += len(messages)
+                summary["dts"] = dts
+                if header.get("title") is None:
+                    header["title"] = summary.get("title")
+                return summary
+
+            self._update_index(session_id, chat_id, update)
+            self._write_header(header, session_id)
+
+    def compact_chat(self, chat_id: str, session_id: str) -> None:
+        with self._chat_lock(chat_id, session_id):
+            chat = self.get_chat(chat_id, session_id)
+            if chat:
+                self.save_chat(chat, session_id)
+
+    def get_chat(self, chat_id: str, session_id: str) -> Optional[Dict]:
+        with self._chat_lock(chat_id, session_id):
+            return self._read_chat(chat_id, session_id)
+
+    def _read_chat(self, chat_id: str, session_id: str) -> Dict:
+        """Read a chat's header and messages"""
+        filepath = self._get_chat_filepath(chat_id, session_id)
+        chat_data = {}
+        try:
+            chat_data = loads_json(self._read_file(filepath))
+        except Exception as e:
+            print(f"Error loading chat history from {filepath}: {str(e)}")
+            traceback.print_exc()
+            return chat_data
+
+        # Older chats keep their messages in the header file. Compaction writes the
+        # full log before the header without messages, so once a log exists it
+        # holds every message, even if a crash left the old header behind
+        header_messages = chat_data.pop("messages", [])
+        log_messages = self._read_log(chat_id, session_id)
+        chat_data["messages"] = header_messages if log_messages is None else log_messages
+        return chat_data
+
+    def list_chats(
+        self, session_id: str, limit: Optional[int] = None, offset: int = 0
+    ) -> List[Dict]:
+        index = self._load_index(session_id)
+        if limit:
+            return heapq.nlargest(
+                offset + limit, index.values(), key=lambda x: x.get("dts", 0)
+            )[offset:]
+
+        return sorted(index.values(), key=lambda x: x.get("dts", 0), reverse=True)[
+            offset:
+        ]
+
+
+class SQLiteChatStorage(ChatStorage):
+    """
+    Stores chats in a SQLite database in WAL mode.
+
+    Messages are append-only rows keyed by their position in the chat, so saving
+    a chat only inserts the messages that are not stored yet.
+    """
+
+    def __init__(self, history_dir: str):
+        self.db_path = os.path.join(history_dir, SQLITE_FILENAME)
+        # A single connection shared by all threads, serialised with a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chats (
+                    session_id TEXT NOT NULL,
+                    chat_id TEXT NOT NULL,
+                    title TEXT,
+                    dts INTEGER NOT NULL DEFAULT 0,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (session_id, chat_id)
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS chats_by_dts ON chats (session_id, dts DESC)"
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS messages (
+                    session_id TEXT NOT NULL,
+                    chat_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    message TEXT NOT NULL,
+                    PRIMARY KEY (session_id, chat_id, seq)
+                )
+                """
+            )
+
+    def save_chat(self, chat: Dict, session_id: str) -> None:
+        messages = chat.get("messages", [])
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT message_count FROM chats WHERE session_id = ? AND chat_id = ?",
+                (session_id, chat["chat_id"]),
+            ).fetchone()
+            stored_count = row["message_count"] if row else 0
+
+            # Only insert the messages added since the last save
+            self._conn.executemany(
+                "INSERT INTO messages (session_id, chat_id, seq, message) VALUES (?, ?, ?, ?)",
+                [
+                    (session_id, chat["chat_id"], seq, dumps_json(message))
+                    for seq, message in enumerate(messages[stored_count:], stored_count)
+                ],
+            )
+            self._conn.execute(
+                """
+                INSERT INTO chats (session_id, chat_id, title, dts, message_count)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (session_id, chat_id) DO UPDATE SET
+                    title = excluded.title,
+                    dts = excluded.dts,
+                    message_count = MAX(chats.message_count, excluded.message_count)
+                """,
+                (
+                    session_id,
+                    chat["chat_id"],
+                    chat.get("title"),
+                    chat.get("dts", 0),
+                    len(messages),
+                ),
+            )
+
+    def append_messages(
+        self, chat_id: str, session_id: str, messages: List[Dict], dts: int
+    ) -> None:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT message_count FROM chats WHERE session_id = ? AND chat_id = ?",
+                (session_id, chat_id),
+            ).fetchone()
+            if row is None:
+                raise KeyError(f"Chat {chat_id} not found")
+            stored_count = row["message_count"]
+
+            self._conn.executemany(
+                "INSERT INTO messages (session_id, chat_id, seq, message) VALUES (?, ?, ?, ?)",
+                [
+                    (session_id, chat_id, seq, dumps_json(message))
+                    for seq, message in enumerate(messages, stored_count)
+                ],
+            )
+            self._conn.execute(
+                """
+                UPDATE chats SET dts = ?, message_count = ?
+                WHERE session_id = ? AND chat_id = ?
+                """,
+                (dts, stored_count + len(messages), session_id, chat_id),
+            )
+
+    def get_chat(self, chat_id: str, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT chat_id, title, dts FROM chats WHERE session_id = ? AND chat_id = ?",
+                (session_id, chat_id),
+            ).fetchone()
+            if row is None:
+                return {}
+            messages = self._conn.execute(
+                "SELECT message FROM messages WHERE session_id = ? AND chat_id = ? ORDER BY seq",
+                (session_id, chat_id),
+            ).fetchall()
+
+        return {
+            "chat_id": row["chat_id"],
+            "title": row["title"],
+            "dts": row["dts"],
+            "messages": [loads_json(message["message"]) for message in messages],
+        }
+
+    def list_chats(
+        self, session_id: str, limit: Optional[int] = None, offset: int = 0
+    ) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT chat_id, title, dts, message_count FROM chats
+                WHERE session_id = ? ORDER BY dts DESC LIMIT ? OFFSET ?
+                """,
+                (session_id, limit if limit else -1, offset),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def create_chat_storage(
+    history_dir: str, backend: str = CHAT_STORAGE_BACKEND
+) -> ChatStorage:
+    """Create the chat storage backend selected by CHAT_STORAGE_BACKEND"""
+    if backend == "file":
+        return FileChatStorage(history_dir, buffer=write_behind)
+    if backend == "sqlite":
+        return SQLiteChatStorage(history_dir)
+    raise ValueError(f"Unknown chat storage backend: {backend}")
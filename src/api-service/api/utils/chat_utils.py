@@ -1,13 +1,26 @@
-import json
 import os
-from typing import Dict, List, Optional
-import glob
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+import asyncio
 import base64
 import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
 from pydantic import BaseModel, Field
 
+from api.utils.chat_storage import create_chat_storage, dumps_json
+from api.utils.image_store import ImageStore
+from api.utils.session_cache import ChatSessionCache
+
 persistent_dir = "/persistent"
 
+# Threads dedicated to chat history file I/O, shared by all models
+CHAT_IO_THREADS = int(os.getenv("CHAT_IO_THREADS", "8"))
+chat_io_executor = ThreadPoolExecutor(
+    max_workers=CHAT_IO_THREADS, thread_name_prefix="chat-io"
+)
+
 
 class ChatMessage(BaseModel):
     content: Optional[str] = Field(None, description="The message content")
@@ -16,6 +29,15 @@ class ChatMessage(BaseModel):
     role: Optional[str] = Field(None, description="The role")
 
 
+# Stop proxies (nginx ingress) from buffering the event stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format a server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {dumps_json(data)}\n\n"
+
+
 class ChatHistoryManager:
     def __init__(self, model, history_dir: str = "chat-history"):
         """Initialize the chat history manager with the specified directory"""
@@ -23,19 +45,17 @@ class ChatHistoryManager:
         self.history_dir = os.path.join(persistent_dir, history_dir, model)
         self.images_dir = os.path.join(self.history_dir, "images")
         self._ensure_directories()
+        self.storage = create_chat_storage(self.history_dir)
+        self.image_store = ImageStore(self.images_dir)
 
     def _ensure_directories(self) -> None:
         """Ensure the chat history directory exists"""
         os.makedirs(self.history_dir, exist_ok=True)
         os.makedirs(self.images_dir, exist_ok=True)
 
-    def _get_chat_filepath(self, chat_id: str, session_id: str) -> str:
-        """Get the full file path for a chat JSON file"""
-        return os.path.join(self.history_dir, session_id, f"{chat_id}.json")
-
     def _save_image(self, chat_id: str, message_id: str, image_data: str) -> str:
         """
-        Save image data to a file and return the relative path.
+        Save image data to the image store and return the relative path it is served from.
 
         Args:
             chat_id: The chat ID
@@ -45,35 +65,49 @@ class ChatHistoryManager:
         Returns:
             str: Relative path to the saved image
         """
-        # Create chat-specific image directory
-        chat_images_dir = os.path.join(self.images_dir, chat_id)
-        os.makedirs(chat_images_dir, exist_ok=True)
-
-        # Save image to file
-        image_path = os.path.join(chat_images_dir, f"{message_id}.png")
         try:
-            # Extract the actual base64 data and mime type
-            base64_string = image_data
-            if "," in base64_string:
-                header, base64_data = base64_string.split(",", 1)
-                mime_type = header.split(":")[1].split(";")[0]
-            else:
-                base64_data = base64_string
-                mime_type = "image/jpeg"  # default to JPEG if no header
+            # Extract the actual base64 data, the data URL's declared type is not
+            # trusted, the image store sniffs the type from the bytes
+            base64_data = image_data.split(",", 1)[-1]
 
             # Decode base64 to bytes
             image_bytes = base64.b64decode(base64_data)
 
-            with open(image_path, "wb") as f:
-                f.write(image_bytes)
+            # Identical images are stored once, however many messages use them
+            self.image_store.put(chat_id, message_id, image_bytes)
 
-            # Return relative path from chat history root
-            return os.path.relpath(image_path, self.history_dir)
+            # Return relative path from chat history root, matching the image route
+            return os.path.join("images", chat_id, f"{message_id}.png")
         except Exception as e:
             print(f"Error saving image: {str(e)}")
             traceback.print_exc()
             return ""
 
+    def get_image(
+        self, chat_id: str, message_id: str
+    ) -> Optional[Tuple[str, str, Optional[str]]]:
+        """
+        Get the file path, mime type and content hash of a message's image.
+
+        Args:
+            chat_id: The chat ID
+            message_id: The message ID
+
+        Returns:
+            Optional[Tuple[str, str, Optional[str]]]: The image file path, mime type and
+            content hash (None for images saved before the image store), None if not found
+        """
+        image = self.image_store.resolve(chat_id, message_id)
+        if image is not None:
+            return image
+
+        # Images saved before the image store were written per message
+        image_path = Path(self.images_dir, chat_id, f"{message_id}.png").resolve()
+        images_dir = Path(self.images_dir).resolve()
+        if images_dir not in image_path.parents or not image_path.exists():
+            return None
+        return str(image_path), "image/png", None
+
     def _load_image(self, relative_path: str) -> Optional[str]:
         """
         Load image data from file and return as base64.
@@ -84,10 +118,11 @@ class ChatHistoryManager:
         Returns:
             Optional[str]: Base64 encoded image data or None if loading fails
         """
-        full_path = os.path.join(self.history_dir, relative_path)
         try:
-            if os.path.exists(full_path):
-                with open(full_path, "rb") as f:
+            _, chat_id, filename = Path(relative_path).parts
+            image = self.get_image(chat_id, Path(filename).stem)
+            if image is not None:
+                with open(image[0], "rb") as f:
                     image_bytes = f.read()
                 return base64.b64encode(image_bytes).decode("utf-8")
         except Exception as e:
@@ -95,65 +130,169 @@ class ChatHistoryManager:
             traceback.print_exc()
         return None
 
-    def save_chat(self, chat_to_save: Dict, session_id: str) -> None:
-        """Save a chat to both memory and file, handling images separately"""
-        chat_dir = os.path.join(self.history_dir, session_id)
-        os.makedirs(chat_dir, exist_ok=True)
-
-        # Process messages to save images separately
-        for message in chat_to_save["messages"]:
+    def _save_message_images(self, chat_id: str, messages: List[Dict]) -> None:
+        """Save message images to files, replacing them with their paths"""
+        for message in messages:
             if "image" in message and message["image"] is not None:
                 # print("image:",message["image"])
                 # Save image and replace with path
                 image_path = self._save_image(
-                    chat_to_save["chat_id"], message["message_id"], message["image"]
+                    chat_id, message["message_id"], message["image"]
                 )
                 if image_path:
                     message["image_path"] = image_path
                 del message["image"]
 
+    def save_chat(self, chat_to_save: Dict, session_id: str) -> None:
+        """Save a chat to the storage backend, handling images separately"""
+        # Process messages to save images separately
+        self._save_message_images(chat_to_save["chat_id"], chat_to_save["messages"])
+
         # Save chat data
-        filepath = self._get_chat_filepath(chat_to_save["chat_id"], session_id)
         try:
-            with open(filepath, "w", encoding="utf-8") as f:
-                json.dump(chat_to_save, f, indent=2, ensure_ascii=False)
+            self.storage.save_chat(chat_to_save, session_id)
         except Exception as e:
             print(f"Error saving chat {chat_to_save['chat_id']}: {str(e)}")
             traceback.print_exc()
             raise e
 
-    def get_chat(self, chat_id: str, session_id: str) -> Optional[Dict]:
-        """Get a specific chat by ID"""
-        filepath = os.path.join(self.history_dir, session_id, f"{chat_id}.json")
-        chat_data = {}
+    def append_messages(
+        self, chat_id: str, session_id: str, messages: List[Dict], dts: int
+    ) -> None:
+        """
+        Append the messages of a new turn to an existing chat.
+        Only the new messages are processed and written, not the whole history.
+        """
+        self._save_message_images(chat_id, messages)
         try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                chat_data = json.load(f)
+            self.storage.append_messages(chat_id, session_id, messages, dts)
         except Exception as e:
-            print(f"Error loading chat history from {filepath}: {str(e)}")
+            print(f"Error saving chat {chat_id}: {str(e)}")
             traceback.print_exc()
-        return chat_data
+            raise e
+
+    def compact_chat(self, chat_id: str, session_id: str) -> None:
+        """Rewrite a chat's stored messages in compact form"""
+        self.storage.compact_chat(chat_id, session_id)
+
+    def get_chat(self, chat_id: str, session_id: str) -> Optional[Dict]:
+        """Get a specific chat by ID"""
+        return self.storage.get_chat(chat_id, session_id)
 
     def get_recent_chats(
-        self, session_id: str, limit: Optional[int] = None
+        self, session_id: str, limit: Optional[int] = None, offset: int = 0
     ) -> List[Dict]:
-        """Get recent chats, optionally limited to a specific number"""
-        chat_dir = os.path.join(self.history_dir, session_id)
-        os.makedirs(chat_dir, exist_ok=True)
-        recent_chats = []
-        chat_files = glob.glob(os.path.join(chat_dir, "*.json"))
-        for filepath in chat_files:
-            try:
-                with open(filepath, "r", encoding="utf-8") as f:
-                    chat_data = json.load(f)
-                    recent_chats.append(chat_data)
-            except Exception as e:
-                print(f"Error loading chat history from {filepath}: {str(e)}")
-                traceback.print_exc()
-
-        # Sort by dts
-        recent_chats.sort(key=lambda x: x.get("dts", 0), reverse=True)
-        if limit:
-            return recent_chats[:limit]
-
-        return recent_chats
+        """
+        Get summaries of the most recent chats, optionally limited to a specific number.
+        Use get_chat for the full messages.
+        """
+        return self.storage.list_chats(session_id, limit, offset)
+
+
+class AsyncChatHistoryManager:
+    """
+    Async variant of ChatHistoryManager for use in route handlers.
+    Runs the blocking file I/O on the chat I/O thread pool so it does not block
+    the event loop.
+    """
+
+    def __init__(self, model, history_dir: str = "chat-history"):
+        self.manager = ChatHistoryManager(model, history_dir)
+
+    @property
+    def history_dir(self) -> str:
+        return self.manager.history_dir
+
+    @property
+    def images_dir(self) -> str:
+        return self.manager.images_dir
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(chat_io_executor, partial(func, *args))
+
+    async def save_chat(self, chat_to_save: Dict, session_id: str) -> None:
+        await self._run(self.manager.save_chat, chat_to_save, session_id)
+
+    async def append_messages(
+        self, chat_id: str, session_id: str, messages: List[Dict], dts: int
+    ) -> None:
+        await self._run(
+            self.manager.append_messages, chat_id, session_id, messages, dts
+        )
+
+    async def compact_chat(self, chat_id: str, session_id: str) -> None:
+        await self._run(self.manager.compact_chat, chat_id, session_id)
+
+    async def get_chat(self, chat_id: str, session_id: str) -> Optional[Dict]:
+        return await self._run(self.manager.get_chat, chat_id, session_id)
+
+    async def get_image(
+        self, chat_id: str, message_id: str
+    ) -> Optional[Tuple[str, str, Optional[str]]]:
+        return await self._run(self.manager.get_image, chat_id, message_id)
+
+    async def get_recent_chats(
+        self, session_id: str, limit: Optional[int] = None, offset: int = 0
+    ) -> List[Dict]:
+        return await self._run(
+            self.manager.get_recent_chats, session_id, limit, offset
+        )
+
+
+async def stream_chat_response(
+    chat: Dict,
+    chat_session,
+    message_dict: Dict,
+    x_session_id: str,
+    chat_manager: AsyncChatHistoryManager,
+    generate_chat_response_stream: Callable[[Any, Dict], AsyncIterator[str]],
+    chat_sessions: ChatSessionCache,
+):
+    """Stream the assistant reply as server-sent events and save the chat once it completes"""
+    yield sse_event(
+        "chat", {"chat_id": chat["chat_id"], "title": chat["title"], "dts": chat["dts"]}
+    )
+
+    # Forward token deltas as they arrive
+    content = []
+    try:
+        async for delta in generate_chat_response_stream(chat_session, message_dict):
+            content.append(delta)
+            yield sse_event("delta", {"content": delta})
+    except Exception as e:
+        print(f"Error streaming response: {str(e)}")
+        traceback.print_exc()
+        yield sse_event("error", {"detail": f"Failed to generate response: {str(e)}"})
+        return
+
+    # Add messages
+    new_messages = [
+        message_dict,
+        {
+            "message_id": str(uuid.uuid4()),
+            "role": "assistant",
+            "content": "".join(content),
+        },
+    ]
+
+    # Save chat, continued chats only append the new turn
+    try:
+        if chat["messages"]:
+            chat["messages"].extend(new_messages)
+            await chat_manager.append_messages(
+                chat["chat_id"], x_session_id, new_messages, chat["dts"]
+            )
+        else:
+            chat["messages"].extend(new_messages)
+            await chat_manager.save_chat(chat, x_session_id)
+    except Exception as e:
+        print(f"Error saving chat {chat['chat_id']}: {str(e)}")
+        traceback.print_exc()
+        # The client already shows the reply, tell it the turn was not saved
+        yield sse_event("error", {"detail": f"Failed to save chat: {str(e)}"})
+        return
+
+    # Cache the session once the turn is saved, storing it again measures its grown history
+    chat_sessions[chat["chat_id"]] = chat_session
+    yield sse_event("done", chat)
@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+
+from chromadb.api import ClientAPI
+from chromadb.api.models.Collection import Collection
+
+# How often the cached collection handle is re-resolved, which also checks the
+# server is healthy and picks up a collection recreated by vector-db/cli.py --load
+CHROMA_COLLECTION_REFRESH_SECONDS = float(
+    os.getenv("CHROMA_COLLECTION_REFRESH_SECONDS", "60")
+)
+
+
+class CollectionHandle:
+    """
+    Cached handle to a Chroma collection.
+
+    The collection is resolved once with get_collection and reused for every query,
+    instead of one get_collection round-trip per message. The chroma HttpClient
+    keeps a pooled keep-alive HTTP session, so queries reuse its connections.
+
+    The handle is re-resolved every refresh_seconds, and straight away when a query
+    fails, so a collection that was deleted and loaded again (it gets a new id) is
+    picked up without restarting the service.
+
+    The methods block on HTTP calls, run them in the threadpool from async code.
+    """
+
+    def __init__(
+        self,
+        client: ClientAPI,
+        name: str,
+        refresh_seconds: float = CHROMA_COLLECTION_REFRESH_SECONDS,
+    ):
+        self.client = client
+        self.name = name
+        self.refresh_seconds = refresh_seconds
+        self._collection: Optional[Collection] = None
+        self._resolved_at = 0.0
+        self._lock = threading.Lock()
+        self.resolves = 0
+        self.reloads = 0
+
+    @property
+    def collection_id(self) -> Optional[str]:
+        """Id of the cached collection, it changes when the collection is reloaded"""
+        collection = self._collection
+        return str(collection.id) if collection is not None else None
+
+    def _resolve(self, stale: Optional[Collection] = None) -> Collection:
+        with self._lock:
+            # Another thread may have re-resolved while we waited for the lock
+            if self._collection is not None and self._collection is not stale:
+                return self._collection
+
+            collection = self.client.get_collection(name=self.name)
+            if self._collection is not None and collection.id != self._collection.id:
+                print(f"Collection {self.name} was reloaded, id {collection.id}")
+                self.reloads += 1
+            self._collection = collection
+            self._resolved_at = time.monotonic()
+            self.resolves += 1
+            return collection
+
+    def get(self) -> Collection:
+        """Get the collection, re-resolving it if it has not been checked recently"""
+        collection = self._collection
+        if collection is None:
+            return self._resolve()
+        if time.monotonic() - self._resolved_at >= self.refresh_seconds:
+            try:
+                return self._resolve(stale=collection)
+            except Exception as e:
+                # Keep serving from the cached handle, the query reports real failures
+                print(f"Error refreshing collection {self.name}: {str(e)}")
+                traceback.print_exc()
+        return collection
+
+    def query(self, **kwargs) -> Dict:
+        """Query the collection, re-resolving it once if the cached handle is stale"""
+        collection = self.get()
+        try:
+            return collection.query(**kwargs)
+        except Exception:
+            # The collection may have been recreated, retry only if its id changed
+            fresh = self._resolve(stale=collection)
+            if fresh.id == collection.id:
+                raise
+            return fresh.query(**kwargs)
+
+    def health(self) -> Dict:
+        """Check the chroma server and the collection are reachable"""
+        try:
+            self.client.heartbeat()
+            collection = self._resolve(stale=self._collection)
+            return {
+                "healthy": True,
+                "collection": self.name,
+                "collection_id": str(collection.id),
+                "resolves": self.resolves,
+                "reloads": self.reloads,
+            }
+        except Exception as e:
+            return {"healthy": False, "collection": self.name, "error": str(e)}
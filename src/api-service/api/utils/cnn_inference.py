@@ -0,0 +1,183 @@
+import glob
+import os
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+import tensorflow as tf
+
+from api.utils.cnn_runtime import INPUT_SHAPE
+
+QUANTIZATIONS = {
+    "tflite": ("float16", "int8"),
+    "onnx": ("int8",),
+}
+
+
+@tf.function(input_signature=[tf.TensorSpec(shape=[], dtype=tf.string)])
+def decode_preprocess_image(image_bytes):
+    # Same decode, resize and normalisation as the training and tf.data pipelines
+    image = tf.io.decode_image(image_bytes, channels=INPUT_SHAPE[2], expand_animations=False)
+    image = tf.image.resize(image, INPUT_SHAPE[:2])
+    return image / 255
+
+
+def load_labelled_images(
+    image_folder: str,
+    label2index: Dict[str, int],
+    per_label: Optional[int] = None,
+    skip: int = 0,
+    preprocess: Optional[Callable[[bytes], np.ndarray]] = None,
+):
+    """
+    Preprocess the images of a dataset folder laid out as <label>/<image>, for the
+    labels in data_details. Returns the images and their label indices.
+
+    Takes per_label images of each label in file name order after skipping the
+    first skip, so disjoint samples can be drawn from the same folder. preprocess
+    takes the encoded image, decode_preprocess_image by default.
+    """
+    images, labels = [], []
+    for label, index in sorted(label2index.items(), key=lambda item: item[1]):
+        paths = sorted(glob.glob(os.path.join(image_folder, label, "*")))
+        paths = paths[skip : skip + per_label if per_label is not None else None]
+        for path in paths:
+            if preprocess is not None:
+                with open(path, "rb") as f:
+                    images.append(preprocess(f.read()))
+            else:
+                images.append(decode_preprocess_image(tf.io.read_file(path)).numpy())
+            labels.append(index)
+    if not images:
+        raise FileNotFoundError(f"No images for the data_details labels in {image_folder}")
+    return np.stack(images), np.array(labels)
+
+
+def outputs_logits(model: tf.keras.Model) -> bool:
+    """Whether the model outputs logits rather than softmax probabilities"""
+    return model.layers[-1].activation.__name__ != "softmax"
+
+
+def probabilities_model(
+    model: tf.keras.Model, input_shape: Sequence[int] = INPUT_SHAPE
+) -> tf.keras.Model:
+    """The model with a softmax layer appended when it outputs logits, for export"""
+    if not outputs_logits(model):
+        return model
+    return tf.keras.Sequential(
+        [tf.keras.Input(shape=input_shape), model, tf.keras.layers.Softmax()]
+    )
+
+
+def probabilities_function(model: tf.keras.Model, input_shape: Sequence[int] = INPUT_SHAPE):
+    """
+    tf.function with a fixed input signature, batches of any size by input_shape,
+    returning class probabilities: softmax is applied when the model outputs logits.
+    """
+    apply_softmax = outputs_logits(model)
+
+    @tf.function(
+        input_signature=[
+            tf.TensorSpec(shape=[None, *input_shape], dtype=tf.float32, name="input")
+        ]
+    )
+    def infer(images):
+        prediction = model(images, training=False)
+        if apply_softmax:
+            prediction = tf.nn.softmax(prediction)
+        return prediction
+
+    return infer
+
+
+def compile_inference(
+    model: tf.keras.Model,
+    input_shape: Sequence[int] = INPUT_SHAPE,
+    warmup_batch_sizes: Sequence[int] = (1,),
+) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    Wrap a Keras model in probabilities_function and warm it up.
+
+    Calling the model through it skips the data adapter, callbacks and progress
+    bar set up by model.predict on every call, and the fixed signature means the
+    graph is traced once, by the warm-up, and never retraced for a new batch size.
+    """
+    infer = probabilities_function(model, input_shape)
+
+    # Trace the graph and let the kernels pick their algorithms before serving
+    for batch_size in warmup_batch_sizes:
+        infer(tf.zeros([batch_size, *input_shape], dtype=tf.float32))
+
+    def predict(images: np.ndarray) -> np.ndarray:
+        return infer(tf.convert_to_tensor(images, dtype=tf.float32)).numpy()
+
+    return predict
+
+
+def export_tflite(
+    model: tf.keras.Model,
+    output_path: str,
+    quantization: str = "",
+    calibration_images: Optional[np.ndarray] = None,
+) -> None:
+    """
+    Convert the model to a TFLite flatbuffer that outputs class probabilities.
+
+    quantization "float16" halves the weights, "int8" quantises weights and
+    activations (inputs and outputs stay float32) and needs calibration_images,
+    a few hundred preprocessed training images.
+    """
+    # Converting from a Keras model freezes its weights into the flatbuffer
+    converter = tf.lite.TFLiteConverter.from_keras_model(probabilities_model(model))
+    if quantization == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if calibration_images is None or len(calibration_images) == 0:
+            raise ValueError("int8 quantization needs calibration images")
+
+        def representative_dataset():
+            for image in calibration_images:
+                yield [image[np.newaxis].astype(np.float32)]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+    elif quantization:
+        raise ValueError(f"Unsupported TFLite quantization {quantization}")
+
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model: tf.keras.Model, output_path: str, quantization: str = "") -> None:
+    """
+    Convert the model to ONNX, outputting class probabilities. Needs tf2onnx, which
+    is only used for the export and is not a dependency of the service.
+
+    quantization "int8" applies ONNX Runtime dynamic quantization to the weights
+    (8-bit, stored as uint8).
+    """
+    try:
+        import tf2onnx
+    except ImportError:
+        raise RuntimeError(
+            "ONNX export needs tf2onnx, install it with: pip install tf2onnx 'onnx<1.18'"
+        )
+    if quantization not in ("", "int8"):
+        raise ValueError(f"Unsupported ONNX quantization {quantization}")
+
+    infer = probabilities_function(model)
+    float_path = output_path + ".float32" if quantization else output_path
+    # tf2onnx freezes the variables captured by the function into the graph
+    tf2onnx.convert.from_function(
+        infer,
+        input_signature=infer.input_signature,
+        opset=17,
+        output_path=float_path,
+    )
+
+    if quantization == "int8":
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        # The CPU ConvInteger kernel only takes uint8 weights
+        quantize_dynamic(float_path, output_path, weight_type=QuantType.QUInt8)
+        os.remove(float_path)
@@ -0,0 +1,178 @@
+import io
+import os
+import threading
+from typing import Callable
+
+import numpy as np
+from PIL import Image
+
+# Trained model, downloaded by llm_cnn_utils.load_cnn_model
+EXPERIMENTS_PATH = "/persistent/experiments"
+EXPERIMENT_NAME = "experiment_1760994796"
+KERAS_MODEL_PATH = os.path.join(
+    EXPERIMENTS_PATH, EXPERIMENT_NAME, "mobilenetv2_train_base_True.keras"
+)
+DATA_DETAILS_PATH = os.path.join(EXPERIMENTS_PATH, EXPERIMENT_NAME, "data_details.json")
+
+# Inference backend for the CNN: "keras" (TensorFlow), "tflite" or "onnx"
+CNN_BACKEND = os.getenv("CNN_BACKEND", "keras").lower()
+# Quantised variant exported by cli.py --export --quantize, empty for float32
+CNN_QUANTIZATION = os.getenv("CNN_QUANTIZATION", "").lower()
+# Intra-op threads for the tflite/onnx runtimes, 0 lets the runtime decide
+CNN_RUNTIME_THREADS = int(os.getenv("CNN_RUNTIME_THREADS", "0"))
+
+RUNTIME_BACKENDS = ("tflite", "onnx")
+
+# Input of the cheese classifier, height x width x channels
+INPUT_SHAPE = (224, 224, 3)
+
+
+def runtime_model_path(
+    keras_model_path: str, backend: str, quantization: str = ""
+) -> str:
+    """Path the model is exported to for a runtime backend, next to the .keras file"""
+    stem = os.path.splitext(keras_model_path)[0]
+    suffix = f"-{quantization}" if quantization else ""
+    return f"{stem}{suffix}.{backend}"
+
+
+def _bilinear_axis(out_size: int, in_size: int):
+    # Half-pixel centres, sampled positions are clamped to the image like in TF
+    x = (np.arange(out_size, dtype=np.float32) + 0.5) * np.float32(
+        in_size / out_size
+    ) - 0.5
+    x_floor = np.floor(x)
+    lower = np.maximum(x_floor, 0).astype(np.int64)
+    upper = np.minimum(np.ceil(x), in_size - 1).astype(np.int64)
+    return lower, upper, (x - x_floor).astype(np.float32)
+
+
+def resize_bilinear(image: np.ndarray, height: int, width: int) -> np.ndarray:
+    """
+    Resize a (height, width, channels) image like tf.image.resize, bilinear with
+    half-pixel centres and no antialiasing, which Pillow's resize applies.
+    """
+    top, bottom, y_lerp = _bilinear_axis(height, image.shape[0])
+    left, right, x_lerp = _bilinear_axis(width, image.shape[1])
+    # Gather the sampled pixels before converting, not the whole image
+    top_left, top_right, bottom_left, bottom_right = (
+        image[rows[:, np.newaxis], columns].astype(np.float32)
+        for rows, columns in ((top, left), (top, right), (bottom, left), (bottom, right))
+    )
+    x_lerp = x_lerp[np.newaxis, :, np.newaxis]
+    top_values = top_left + (top_right - top_left) * x_lerp
+    bottom_values = bottom_left + (bottom_right - bottom_left) * x_lerp
+    return top_values + (bottom_values - top_values) * y_lerp[:, np.newaxis, np.newaxis]
+
+
+def decode_resize_image(image_bytes: bytes) -> np.ndarray:
+    """
+    Decode, resize and normalise an encoded image with Pillow and NumPy, like
+    cnn_inference.decode_preprocess_image without importing TensorFlow.
+    Raises ValueError if the image cannot be decoded.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # First frame of animations, alpha is dropped like decode_image(channels=3)
+            pixels = np.asarray(image.convert("RGB"))
+    except Exception as e:
+        raise ValueError(f"Invalid image: {str(e)}")
+    return resize_bilinear(pixels, *INPUT_SHAPE[:2]) / np.float32(255)
+
+
+def preprocess_image(image_bytes: bytes, backend: str = CNN_BACKEND) -> np.ndarray:
+    """
+    Preprocess an encoded image for a CNN backend, as a (height, width, channels)
+    array. The keras backend decodes with TensorFlow like training, the tflite and
+    onnx runtimes use Pillow and NumPy so the service never imports TensorFlow.
+    Raises ValueError if the image cannot be decoded.
+    """
+    if backend != "keras":
+        return decode_resize_image(image_bytes)
+
+    import tensorflow as tf
+
+    from api.utils.cnn_inference import decode_preprocess_image
+
+    try:
+        return decode_preprocess_image(tf.constant(image_bytes)).numpy()
+    except tf.errors.InvalidArgumentError:
+        raise ValueError("Invalid image, TensorFlow could not decode it")
+
+
+class TFLiteModel:
+    """
+    Exported model run by the LiteRT (TFLite) interpreter. Uses the standalone
+    ai-edge-litert package when it is installed, else the interpreter in tensorflow,
+    so install ai-edge-litert to keep TensorFlow out of the service.
+
+    Takes float32 images and returns class probabilities like the compiled Keras
+    model, the input tensor is resized when the batch size changes.
+    """
+
+    def __init__(self, model_path: str, num_threads: int = CNN_RUNTIME_THREADS):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(
+            model_path=model_path, num_threads=num_threads or None
+        )
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.interpreter.allocate_tensors()
+        self._batch_size = int(self.input["shape"][0])
+        # An interpreter holds its tensors, so only one batch can run at a time
+        self._lock = threading.Lock()
+
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        images = np.asarray(images, dtype=np.float32)
+        with self._lock:
+            if images.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self.input["index"], images.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = images.shape[0]
+            self.interpreter.set_tensor(self.input["index"], images)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output["index"]).copy()
+
+
+class ONNXModel:
+    """
+    Exported model run by ONNX Runtime on the CPU.
+
+    Takes float32 images and returns class probabilities like the compiled Keras
+    model. An InferenceSession can be run from several threads.
+    """
+
+    def __init__(self, model_path: str, num_threads: int = CNN_RUNTIME_THREADS):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, images: np.ndarray) -> np.ndarray:
+        images = np.asarray(images, dtype=np.float32)
+        return self.session.run(None, {self.input_name: images})[0]
+
+
+def load_runtime_model(
+    backend: str, model_path: str, num_threads: int = CNN_RUNTIME_THREADS
+) -> Callable[[np.ndarray], np.ndarray]:
+    """Load an exported model for the tflite or onnx backend"""
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(
+            f"{model_path} not found, export it with: python cli.py --export --backend {backend}"
+        )
+    if backend == "tflite":
+        return TFLiteModel(model_path, num_threads)
+    if backend == "onnx":
+        return ONNXModel(model_path, num_threads)
+    raise ValueError(f"Unknown CNN backend {backend}, expected one of {RUNTIME_BACKENDS}")
@@ -0,0 +1,75 @@
+import gzip
+import os
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder, IdentityResponder
+from starlette.types import Message, Receive, Scope, Send
+
+# Responses smaller than this are sent uncompressed
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1024"))
+# Level 6 gets most of the size reduction of level 9 for a fraction of the CPU
+GZIP_COMPRESS_LEVEL = int(os.getenv("GZIP_COMPRESS_LEVEL", "6"))
+
+# Content types worth compressing, images and audio are already compressed
+COMPRESSIBLE_CONTENT_TYPES = (
+    "application/json",
+    "application/javascript",
+    "image/svg+xml",
+    "text/",
+)
+# Streamed events must reach the client as they are produced
+EXCLUDED_CONTENT_TYPES = ("text/event-stream",)
+
+
+def is_compressible(message: Message) -> bool:
+    """Check if a response should be compressed from its start message"""
+    if message["status"] == 206:
+        # Compressing a byte range would break the range offsets
+        return False
+    content_type = Headers(raw=message["headers"]).get("content-type", "")
+    return content_type.startswith(
+        COMPRESSIBLE_CONTENT_TYPES
+    ) and not content_type.startswith(EXCLUDED_CONTENT_TYPES)
+
+
+def gzip_compress(body: bytes) -> bytes:
+    """Compress a response body once, e.g. for precompressed responses"""
+    return gzip.compress(body, compresslevel=GZIP_COMPRESS_LEVEL, mtime=0)
+
+
+class CompressibleGZipResponder(GZipResponder):
+    async def send_with_compression(self, message: Message) -> None:
+        await super().send_with_compression(message)
+        if message["type"] == "http.response.start":
+            # Pass the response through unchanged unless its content type compresses
+            self.content_type_is_excluded = not is_compressible(message)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Gzip JSON and text responses larger than minimum_size for clients that accept it.
+    Unlike GZipMiddleware, images, audio and partial content are passed through,
+    as are responses that already set a Content-Encoding (precompressed bodies).
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = GZIP_MINIMUM_SIZE,
+        compresslevel: int = GZIP_COMPRESS_LEVEL,
+    ) -> None:
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        if "gzip" in headers.get("Accept-Encoding", ""):
+            responder = CompressibleGZipResponder(
+                self.app, self.minimum_size, compresslevel=self.compresslevel
+            )
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size)
+        await responder(scope, receive, send)
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# Cache limits, can be overridden from the environment
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "10000"))
+# Optional SQLite file that keeps embeddings across restarts, disabled when empty
+EMBEDDING_CACHE_DB = os.getenv("EMBEDDING_CACHE_DB", "")
+EMBEDDING_CACHE_DB_MAX_ENTRIES = int(
+    os.getenv("EMBEDDING_CACHE_DB_MAX_ENTRIES", "200000")
+)
+
+# Old rows are pruned from the SQLite tier once every this many inserts
+PRUNE_INTERVAL = 1000
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normalise a query so trivially different spellings of the same question
+    ("How is Brie made?" and "how is brie made") share a cache entry.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(" ?!.")
+
+
+class EmbeddingCache:
+    """
+    Bounded cache of query embeddings keyed on the normalised text, the embedding
+    model and the output dimensionality.
+
+    The first tier is an in-memory LRU of max_entries embeddings. When db_path is
+    set, embeddings are also kept in a SQLite file so they survive restarts and
+    are shared by processes on the same volume.
+
+    The methods are blocking when the SQLite tier is enabled, run them in the
+    threadpool from async code.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+        db_path: str = EMBEDDING_CACHE_DB,
+        db_max_entries: int = EMBEDDING_CACHE_DB_MAX_ENTRIES,
+    ):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.db_max_entries = db_max_entries
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._conn = None
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS embeddings (
+                        key TEXT PRIMARY KEY,
+                        embedding BLOB NOT NULL,
+                        created REAL NOT NULL
+                    )
+                    """
+                )
+
+    @staticmethod
+    def make_key(text: str, model: str, dimension: int) -> str:
+        key = f"{model}\0{dimension}\0{normalize_query(text)}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, text: str, model: str, dimension: int) -> Optional[List[float]]:
+        """Get a cached embedding, None on a miss"""
+        key = self.make_key(text, model, dimension)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return embedding
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT embedding FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    embedding = array("d", row[0]).tolist()
+                    self._remember(key, embedding)
+                    self.disk_hits += 1
+                    return embedding
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, model: str, dimension: int, embedding: List[float]) -> None:
+        """Cache an embedding"""
+        key = self.make_key(text, model, dimension)
+        embedding = list(embedding)
+        with self._lock:
+            self._remember(key, embedding)
+            if self._conn is None:
+                return
+
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, embedding, created) VALUES (?, ?, ?)",
+                    (key, array("d", embedding).tobytes(), time.time()),
+                )
+                self._inserts += 1
+                if self._inserts % PRUNE_INTERVAL == 0:
+                    # Keep the newest db_max_entries embeddings
+                    self._conn.execute(
+                        """
+                        DELETE FROM embeddings WHERE key IN (
+                            SELECT key FROM embeddings ORDER BY created DESC
+                            LIMIT -1 OFFSET ?
+                        )
+                        """,
+                        (self.db_max_entries,),
+                    )
+
+    def _remember(self, key: str, embedding: List[float]) -> None:
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        """Cache counters, the hit rate counts hits from either tier"""
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "db_path": self.db_path or None,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,160 @@
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from secrets import token_hex
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import anyio
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+from starlette.types import Send
+
+# Files that never change once written (chat images are stored by content hash)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Files that can be replaced in place, cached for a day and then revalidated
+ASSET_CACHE_CONTROL = "public, max-age=86400"
+
+
+class RangeFileResponse(FileResponse):
+    """
+    FileResponse with standard multipart/byteranges responses for multiple ranges.
+    Starlette puts the multipart boundary in Content-Range instead of Content-Type
+    and separates the parts with bare newlines, which clients fail to parse.
+    """
+
+    def generate_multipart(
+        self,
+        ranges: Sequence[Tuple[int, int]],
+        boundary: str,
+        max_size: int,
+        content_type: str,
+    ) -> Tuple[int, Callable[[int, int], bytes]]:
+        def part_header(start: int, end: int) -> bytes:
+            return (
+                f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Range: bytes {start}-{end - 1}/{max_size}\r\n\r\n"
+            ).encode("latin-1")
+
+        # Each part is its header, its content and a CRLF, then the closing boundary
+        content_length = sum(
+            len(part_header(start, end)) + (end - start) + 2 for start, end in ranges
+        ) + len(f"--{boundary}--\r\n")
+        return content_length, part_header
+
+    async def _handle_multiple_ranges(
+        self,
+        send: Send,
+        ranges: List[Tuple[int, int]],
+        file_size: int,
+        send_header_only: bool,
+    ) -> None:
+        boundary = token_hex(13)
+        content_length, part_header = self.generate_multipart(
+            ranges, boundary, file_size, self.headers["content-type"]
+        )
+        self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+        self.headers["content-length"] = str(content_length)
+        await send(
+            {"type": "http.response.start", "status": 206, "headers": self.raw_headers}
+        )
+        if send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            for start, end in ranges:
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": part_header(start, end),
+                        "more_body": True,
+                    }
+                )
+                await file.seek(start)
+                while start < end:
+                    chunk = await file.read(min(self.chunk_size, end - start))
+                    start += len(chunk)
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+                await send(
+                    {"type": "http.response.body", "body": b"\r\n", "more_body": True}
+                )
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": f"--{boundary}--\r\n".encode("latin-1"),
+                    "more_body": False,
+                }
+            )
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    """Strong ETag for a file from its modification time and size"""
+    etag_base = f"{stat_result.st_mtime}-{stat_result.st_size}"
+    return f'"{hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"'
+
+
+def is_not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """Check the request's conditional headers against the file's validators"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since and uses weak comparison
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(
+                if_modified_since
+            ).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cached_file_response(
+    request: Request,
+    path: str,
+    media_type: str,
+    etag: Optional[str] = None,
+    cache_control: str = ASSET_CACHE_CONTROL,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """
+    Serve a file with ETag, Last-Modified and Cache-Control headers,
+    answering 304 Not Modified when the client already has the current version
+    and 206 Partial Content for Range requests. Content type sniffing is disabled.
+
+    Args:
+        request: The incoming request, for its conditional headers
+        path: Path of the file to serve
+        media_type: Content type of the file
+        etag: Strong validator for the file, defaults to one derived from its mtime and size
+        cache_control: Cache-Control header value
+        headers: Any additional response headers
+
+    Returns:
+        Response: A 304 response or a RangeFileResponse with the file
+    """
+    stat_result = os.stat(path)
+    etag = f'"{etag}"' if etag and not etag.startswith('"') else etag
+    etag = etag or file_etag(stat_result)
+    cache_headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        # Browsers must not second-guess the content type, e.g. render a file as HTML
+        "X-Content-Type-Options": "nosniff",
+        **(headers or {}),
+    }
+
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        # Only validator and caching headers are sent with a 304
+        cache_headers.pop("Content-Disposition", None)
+        return Response(status_code=304, headers=cache_headers)
+
+    return RangeFileResponse(
+        path, media_type=media_type, headers=cache_headers, stat_result=stat_result
+    )
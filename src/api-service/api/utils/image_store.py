@@ -0,0 +1,183 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from api.utils.chat_storage import atomic_write
+
+# SQLite database mapping chat messages to stored images
+IMAGE_INDEX_FILENAME = "images.db"
+
+# File extensions for the image types browsers send
+IMAGE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+}
+# Pillow format names of the image types above
+IMAGE_FORMATS = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+}
+# Type of anything that is not one of the image types above
+FALLBACK_MIME_TYPE = "application/octet-stream"
+
+
+def sniff_image_type(image_bytes: bytes) -> str:
+    """
+    MIME type of an image from its content, never from the type the client
+    declared: one of IMAGE_EXTENSIONS, else FALLBACK_MIME_TYPE.
+    """
+    try:
+        # Only reads the header, the image is not decoded
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            return IMAGE_FORMATS.get(image.format, FALLBACK_MIME_TYPE)
+    except Exception:
+        return FALLBACK_MIME_TYPE
+
+
+class ImageStore:
+    """
+    Content addressed store for chat images.
+
+    Each distinct image is written once to objects/<sha256[:2]>/<sha256><ext>,
+    however many messages reference it. Its type is sniffed from the bytes, data
+    that is not an allowed image type is stored as application/octet-stream
+    without an extension. A SQLite index maps (chat_id, message_id)
+    to the image hash and keeps a reference count per image, the file is removed
+    when its last reference is released.
+    """
+
+    def __init__(self, images_dir: str):
+        self.images_dir = images_dir
+        self.objects_dir = os.path.join(images_dir, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        # A single connection shared by all threads, serialised with a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(images_dir, IMAGE_INDEX_FILENAME), check_same_thread=False
+        )
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS objects (
+                    hash TEXT PRIMARY KEY,
+                    mime_type TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    refcount INTEGER NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS refs (
+                    chat_id TEXT NOT NULL,
+                    message_id TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    PRIMARY KEY (chat_id, message_id)
+                )
+                """
+            )
+
+    def _object_path(self, image_hash: str, mime_type: str) -> str:
+        """Relative path of an image object from the images directory"""
+        extension = IMAGE_EXTENSIONS.get(mime_type, "")
+        return os.path.join("objects", image_hash[:2], image_hash + extension)
+
+    def put(self, chat_id: str, message_id: str, image_bytes: bytes) -> str:
+        """
+        Store an image for a message and return its hash.
+        The bytes are only written if no other message references the same image.
+        """
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        mime_type = sniff_image_type(image_bytes)
+        with self._lock, self._conn:
+            current = self._conn.execute(
+                "SELECT hash FROM refs WHERE chat_id = ? AND message_id = ?",
+                (chat_id, message_id),
+            ).fetchone()
+            if current is not None and current[0] == image_hash:
+                return image_hash
+
+            row = self._conn.execute(
+                "SELECT path FROM objects WHERE hash = ?", (image_hash,)
+            ).fetchone()
+            if row is None:
+                path = self._object_path(image_hash, mime_type)
+                full_path = os.path.join(self.images_dir, path)
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                atomic_write(full_path, image_bytes)
+                self._conn.execute(
+                    "INSERT INTO objects (hash, mime_type, path, size, refcount) VALUES (?, ?, ?, ?, 0)",
+                    (image_hash, mime_type, path, len(image_bytes)),
+                )
+
+            # Point the message at the image, releasing any image it pointed at before
+            self._release(chat_id, message_id)
+            self._conn.execute(
+                "INSERT INTO refs (chat_id, message_id, hash) VALUES (?, ?, ?)",
+                (chat_id, message_id, image_hash),
+            )
+            self._conn.execute(
+                "UPDATE objects SET refcount = refcount + 1 WHERE hash = ?",
+                (image_hash,),
+            )
+        return image_hash
+
+    def resolve(self, chat_id: str, message_id: str) -> Optional[Tuple[str, str, str]]:
+        """
+        Get the (full path, mime type, hash) of a message's image. The mime type is
+        one of IMAGE_EXTENSIONS or FALLBACK_MIME_TYPE, so it is safe to serve.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT objects.path, objects.mime_type, objects.hash FROM refs
+                JOIN objects ON objects.hash = refs.hash
+                WHERE refs.chat_id = ? AND refs.message_id = ?
+                """,
+                (chat_id, message_id),
+            ).fetchone()
+        if row is None:
+            return None
+        # Objects stored before types were sniffed may carry any client type
+        mime_type = row[1] if row[1] in IMAGE_EXTENSIONS else FALLBACK_MIME_TYPE
+        return os.path.join(self.images_dir, row[0]), mime_type, row[2]
+
+    def release(self, chat_id: str, message_id: str) -> None:
+        """Drop a message's reference to its image"""
+        with self._lock, self._conn:
+            self._release(chat_id, message_id)
+
+    def _release(self, chat_id: str, message_id: str) -> None:
+        row = self._conn.execute(
+            "SELECT hash FROM refs WHERE chat_id = ? AND message_id = ?",
+            (chat_id, message_id),
+        ).fetchone()
+        if row is None:
+            return
+        image_hash = row[0]
+        self._conn.execute(
+            "DELETE FROM refs WHERE chat_id = ? AND message_id = ?",
+            (chat_id, message_id),
+        )
+        self._conn.execute(
+            "UPDATE objects SET refcount = refcount - 1 WHERE hash = ?", (image_hash,)
+        )
+        path, refcount = self._conn.execute(
+            "SELECT path, refcount FROM objects WHERE hash = ?", (image_hash,)
+        ).fetchone()
+        if refcount <= 0:
+            self._conn.execute("DELETE FROM objects WHERE hash = ?", (image_hash,))
+            full_path = os.path.join(self.images_dir, path)
+            if os.path.exists(full_path):
+                os.remove(full_path)
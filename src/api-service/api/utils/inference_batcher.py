@@ -0,0 +1,114 @@
+import asyncio
+import os
+import time
+import traceback
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+# Micro-batching limits, can be overridden from the environment
+CNN_MAX_BATCH_SIZE = int(os.getenv("CNN_MAX_BATCH_SIZE", "16"))
+CNN_MAX_BATCH_WAIT_MS = float(os.getenv("CNN_MAX_BATCH_WAIT_MS", "5"))
+
+
+class MicroBatcher:
+    """
+    Gathers concurrent inference requests into micro-batches.
+
+    predict() queues one preprocessed input and waits for its output row. A worker
+    task takes the first queued input, keeps collecting until max_batch_size inputs
+    are queued or max_wait_ms has passed, stacks them into one batch and runs
+    predict_batch on it in the threadpool, then hands each caller its own row.
+    A single request only pays max_wait_ms on top of its forward pass, while
+    concurrent requests share forward passes.
+
+    predict_batch takes an array of inputs stacked on the first axis and returns
+    an array with one output row per input. Batches run one at a time, the model
+    already uses every core for a single forward pass.
+    """
+
+    def __init__(
+        self,
+        predict_batch: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: int = CNN_MAX_BATCH_SIZE,
+        max_wait_ms: float = CNN_MAX_BATCH_WAIT_MS,
+    ):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max_wait_ms
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.batches = 0
+        self.items = 0
+        self.max_batch_seen = 0
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        # The queue and worker belong to the running event loop, start them on first use
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+            self._loop = loop
+        return self._queue
+
+    async def predict(self, item: np.ndarray) -> np.ndarray:
+        """Run one input through the model as part of a batch, returns its output row"""
+        queue = self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((item, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[np.ndarray, asyncio.Future]]:
+        """Wait for a first input, then gather more until the batch is full or the wait is over"""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already queued without waiting
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            timeout = deadline - time.monotonic()
+            if len(batch) >= self.max_batch_size or timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            # Callers that gave up (e.g. the client disconnected) are not run
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            try:
+                inputs = np.stack([item for item, _ in batch])
+                outputs = await run_in_threadpool(self.predict_batch, inputs)
+            except Exception as e:
+                print(f"Error running batch of {len(batch)}: {str(e)}")
+                traceback.print_exc()
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            for row, (_, future) in zip(outputs, batch):
+                if not future.done():
+                    future.set_result(row)
+
+    def stats(self) -> Dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batches": self.batches,
+            "items": self.items,
+            "average_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch_seen": self.max_batch_seen,
+        }
@@ -1,5 +1,5 @@
 import os
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator
 from fastapi import HTTPException
 import base64
 import io
@@ -9,18 +9,29 @@ import zipfile
 import numpy as np
 from PIL import Image
 from pathlib import Path
-from tempfile import TemporaryDirectory
 import traceback
-import tensorflow as tf
-from tensorflow.python.keras import backend as K
-from tensorflow.keras.models import Model
+from fastapi.concurrency import run_in_threadpool
 
 # Vertex AI
 from google import genai
 from google.genai import types
 from google.genai.types import Content, Part, GenerationConfig, ToolConfig
 from google.genai import errors
-from google.genai.chats import Chat
+from google.genai.chats import AsyncChat
+
+from api.utils.cnn_runtime import (
+    CNN_BACKEND,
+    CNN_QUANTIZATION,
+    DATA_DETAILS_PATH,
+    EXPERIMENTS_PATH,
+    KERAS_MODEL_PATH,
+    load_runtime_model,
+    preprocess_image,
+    runtime_model_path,
+)
+from api.utils.inference_batcher import CNN_MAX_BATCH_SIZE, MicroBatcher
+from api.utils.model_loader import BackgroundLoader
+from api.utils.session_cache import ChatSessionCache
 
 # Setup
 GCP_PROJECT = os.environ["GCP_PROJECT"]
@@ -30,11 +41,13 @@ EMBEDDING_DIMENSION = 256
 GENERATIVE_MODEL = "gemini-2.0-flash-001"
 
 # CNN Model details
-AUTOTUNE = tf.data.experimental.AUTOTUNE
-local_experiments_path = "/persistent/experiments"
+# TensorFlow is only imported once the model is loaded, so the API starts fast
+local_experiments_path = EXPERIMENTS_PATH
 best_model = None
 best_model_id = None
 cnn_model = None
+# Inference function returning class probabilities, for the CNN_BACKEND
+cnn_predict = None
 data_details = None
 image_width = 224
 image_height = 224
@@ -65,21 +78,29 @@ Your goal is to provide accurate, helpful information about cheese for each quer
 
 
 # Initialize chat sessions
-chat_sessions: Dict[str, Chat] = {}
+chat_sessions = ChatSessionCache()
 
 
-def create_chat_session(past_history=None) -> Chat:
+def create_chat_session(past_history=None) -> AsyncChat:
     """Create a new chat session with the model"""
-    # Create a new chat session
-    return llm_client.chats.create(model=GENERATIVE_MODEL, history=past_history)
+    # Create a new chat session on the async client so requests don't block the event loop
+    return llm_client.aio.chats.create(model=GENERATIVE_MODEL, history=past_history)
 
 
-def generate_chat_response(chat_session: Chat, message: Dict) -> str:
-    response = chat_session.send_message(message["content"])
+async def generate_chat_response(chat_session: AsyncChat, message: Dict) -> str:
+    response = await chat_session.send_message(message["content"])
     return response.text
 
 
-def rebuild_chat_session(chat_history: List[Dict]) -> Chat:
+async def generate_chat_response_stream(
+    chat_session: AsyncChat, message: Dict
+) -> AsyncIterator[str]:
+    async for chunk in await chat_session.send_message_stream(message["content"]):
+        if chunk.text:
+            yield chunk.text
+
+
+def rebuild_chat_session(chat_history: List[Dict]) -> AsyncChat:
     """Rebuild a chat session with complete context"""
     formatted_history = []
     for message in chat_history:
@@ -109,14 +130,11 @@ def rebuild_chat_session(chat_history: List[Dict]) -> Chat:
 
 def load_cnn_model():
     print("Loading CNN Model...")
-    global cnn_model, data_details
+    global cnn_model, cnn_predict, data_details
 
     os.makedirs(local_experiments_path, exist_ok=True)
 
-    experiment_name = "experiment_1760994796"
-    best_model_path = os.path.join(
-        local_experiments_path, experiment_name, "mobilenetv2_train_base_True.keras"
-    )
+    best_model_path = KERAS_MODEL_PATH
     print("best_model_path:", best_model_path)
     if not os.path.exists(best_model_path):
         # Download from Github for easy access (This needs to be from you GCS bucket or from storage location after training)
@@ -133,23 +151,46 @@ def load_cnn_model():
         ) as zfile:
             zfile.extractall(local_experiments_path)
 
-    cnn_model = tf.keras.models.load_model(best_model_path)
-    print(cnn_model.summary())
+    if CNN_BACKEND == "keras":
+        import tensorflow as tf
+
+        from api.utils.cnn_inference import compile_inference
 
-    data_details_path = os.path.join(
-        local_experiments_path, experiment_name, "data_details.json"
-    )
+        cnn_model = tf.keras.models.load_model(best_model_path)
+        print(cnn_model.summary())
+        cnn_predict = compile_inference(
+            cnn_model,
+            (image_height, image_width, num_channels),
+            warmup_batch_sizes=(1, CNN_MAX_BATCH_SIZE),
+        )
+        # Trace the TensorFlow preprocessing before serving
+        preprocess_image_from_bytes(_warmup_image())
+    else:
+        # Exported model run by a lightweight runtime, see cli.py --export
+        model_path = runtime_model_path(best_model_path, CNN_BACKEND, CNN_QUANTIZATION)
+        print(f"Using the {CNN_BACKEND} backend:", model_path)
+        cnn_predict = load_runtime_model(CNN_BACKEND, model_path)
+
+    data_details_path = DATA_DETAILS_PATH
 
     # Load data details
     with open(data_details_path, "r") as json_file:
         data_details = json.load(json_file)
 
 
-# Load the CNN Model
-load_cnn_model()
+def _warmup_image() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (image_width, image_height)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+# Load the CNN Model in the background, started by the app lifespan
+cnn_loader = BackgroundLoader("cnn", load_cnn_model)
 
 
 def load_preprocess_image_from_path(image_path):
+    import tensorflow as tf
+
     print("Image", image_path)
 
     image_width = 224
@@ -169,31 +210,81 @@ def load_preprocess_image_from_path(image_path):
         return image
 
     test_data = tf.data.Dataset.from_tensor_slices(([image_path]))
-    test_data = test_data.map(load_image, num_parallel_calls=AUTOTUNE)
-    test_data = test_data.map(normalize, num_parallel_calls=AUTOTUNE)
+    test_data = test_data.map(load_image, num_parallel_calls=tf.data.AUTOTUNE)
+    test_data = test_data.map(normalize, num_parallel_calls=tf.data.AUTOTUNE)
     test_data = test_data.repeat(1).batch(1)
 
     return test_data
 
 
-def make_prediction(image_path):
+def preprocess_image_from_bytes(image_bytes: bytes) -> np.ndarray:
+    """Decode & preprocess an encoded image in memory, as a (height, width, channels) array"""
+    try:
+        return preprocess_image(image_bytes, CNN_BACKEND)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid image, it could not be decoded")
 
-    # Load & preprocess
-    test_data = load_preprocess_image_from_path(image_path)
 
-    # Make prediction
-    prediction = cnn_model.predict(test_data)
+def preprocess_image_from_path(image_path) -> np.ndarray:
+    """Load & preprocess one image file, as a (height, width, channels) array"""
+    with open(image_path, "rb") as f:
+        return preprocess_image_from_bytes(f.read())
+
+
+def predict_batch(images: np.ndarray) -> np.ndarray:
+    """Class probabilities for a batch of preprocessed images"""
+    return cnn_predict(images)
+
+
+def prediction_results(prediction: np.ndarray) -> Dict:
+    """Format the prediction for one image, prediction has shape (1, num_classes)"""
     idx = prediction.argmax(axis=1)[0]
     prediction_label = data_details["index2label"][str(idx)]
 
-    if cnn_model.layers[-1].activation.__name__ != "softmax":
-        prediction = tf.nn.softmax(prediction).numpy()
-        print(prediction)
-
     return {
-        "input_image_shape": str(test_data.element_spec.shape),
+        "input_image_shape": str((None, image_height, image_width, num_channels)),
         "prediction_shape": prediction.shape,
         "prediction_label": prediction_label,
         "prediction": prediction.tolist(),
         "accuracy": round(float(np.max(prediction)) * 100, 2),
     }
+
+
+# Concurrent image requests share forward passes
+cnn_batcher = MicroBatcher(predict_batch)
+
+
+def make_prediction(image_path):
+    cnn_loader.ensure_loaded()
+
+    # Load & preprocess
+    image = preprocess_image_from_path(image_path)
+
+    # Make prediction
+    prediction = predict_batch(image[np.newaxis])
+    return prediction_results(prediction)
+
+
+def make_prediction_from_bytes(image_bytes: bytes):
+    cnn_loader.ensure_loaded()
+
+    # Decode & preprocess in memory, no temporary file
+    image = preprocess_image_from_bytes(image_bytes)
+
+    # Make prediction
+    prediction = predict_batch(image[np.newaxis])
+    return prediction_results(prediction)
+
+
+async def make_prediction_from_bytes_batched(image_bytes: bytes):
+    """Make a prediction as part of a micro-batch with other concurrent requests"""
+
+    # Wait for the model if it is still loading, 503 if it is not ready in time
+    await cnn_loader.wait_ready()
+
+    # Decode & preprocess, TensorFlow ops are blocking, run them in the threadpool
+    image = await run_in_threadpool(preprocess_image_from_bytes, image_bytes)
+
+    # Make prediction
+    prediction = await cnn_batcher.predict(image)
+    return prediction_results(prediction[np.newaxis])
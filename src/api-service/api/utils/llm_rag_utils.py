@@ -1,5 +1,5 @@
 import os
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator, Tuple
 from fastapi import HTTPException
 import base64
 import io
@@ -7,13 +7,21 @@ from PIL import Image
 from pathlib import Path
 import traceback
 import chromadb
+from fastapi.concurrency import run_in_threadpool
 
 # Vertex AI
 from google import genai
 from google.genai import types
 from google.genai.types import Content, Part, GenerationConfig, ToolConfig
 from google.genai import errors
-from google.genai.chats import Chat
+from google.genai.chats import AsyncChat
+
+from api.utils.bm25_index import BM25Index, HybridRetriever, HYBRID_RETRIEVAL
+from api.utils.chroma_collection import CollectionHandle
+from api.utils.embedding_cache import EmbeddingCache
+from api.utils.response_cache import SemanticResponseCache
+from api.utils.session_cache import ChatSessionCache
+from api.utils.vector_index import LocalVectorIndex, RETRIEVAL_BACKEND, VECTOR_INDEX_FOLDER
 
 # Setup
 GCP_PROJECT = os.environ["GCP_PROJECT"]
@@ -51,94 +59,103 @@ Your goal is to provide accurate, helpful information about cheese based solely
 """
 
 # Initialize chat sessions
-chat_sessions: Dict[str, Chat] = {}
+chat_sessions = ChatSessionCache()
 
-# Connect to chroma DB
-client = chromadb.HttpClient(host=CHROMADB_HOST, port=CHROMADB_PORT)
 method = "recursive-split"
 collection_name = f"{method}-collection"
-# Get the collection
-#collection = client.get_collection(name=collection_name)
+if RETRIEVAL_BACKEND == "local":
+    # Search the chunk embeddings in process instead of calling the vector db
+    collection = LocalVectorIndex.open(VECTOR_INDEX_FOLDER, method)
+else:
+    # Connect to chroma DB
+    client = chromadb.HttpClient(host=CHROMADB_HOST, port=CHROMADB_PORT)
+    # Get the collection once and reuse it for every message
+    collection = CollectionHandle(client, collection_name)
+if HYBRID_RETRIEVAL:
+    # Fuse the vector results with BM25 keyword matches, so exact names are found
+    collection = HybridRetriever(collection, BM25Index.open(VECTOR_INDEX_FOLDER, method))
+
+# Cache of query embeddings
+query_embedding_cache = EmbeddingCache()
+
+# Opt-in cache of answers to the first question of a chat
+response_cache = SemanticResponseCache()
+
+async def generate_query_embedding(query):
+    # Repeated questions reuse the embedding instead of calling Vertex AI again
+    cached = await run_in_threadpool(
+        query_embedding_cache.get, query, EMBEDDING_MODEL, EMBEDDING_DIMENSION
+    )
+    if cached is not None:
+        return cached
 
-def generate_query_embedding(query):
     kwargs = {
         "output_dimensionality": EMBEDDING_DIMENSION
     }
-    response = llm_client.models.embed_content(
+    response = await llm_client.aio.models.embed_content(
         model=EMBEDDING_MODEL,
         contents=query,
         config=types.EmbedContentConfig(**kwargs)
     )
-    return response.embeddings[0].values
+    embedding = response.embeddings[0].values
+    await run_in_threadpool(
+        query_embedding_cache.put, query, EMBEDDING_MODEL, EMBEDDING_DIMENSION, embedding
+    )
+    return embedding
+
+async def retrieve_chunks(query: str) -> Tuple[List[float], Dict]:
+    """Embed a query and retrieve the closest chunks from the vector db"""
+    # Create embeddings for the message content
+    query_embedding = await generate_query_embedding(query)
+    query_kwargs = {}
+    if isinstance(collection, HybridRetriever):
+        # The hybrid retriever also ranks chunks by BM25 on the query text
+        query_kwargs["query_texts"] = [query]
+    # Retrieve chunks based on embedding value, every backend is synchronous
+    results = await run_in_threadpool(
+        collection.query,
+        query_embeddings=[query_embedding],
+        n_results=5,
+        **query_kwargs
+    )
+    return query_embedding, results
 
-def create_chat_session(past_history=None) -> Chat:
+def create_chat_session(past_history=None) -> AsyncChat:
     """Create a new chat session with the model"""
-    # Create a new chat session
-    return llm_client.chats.create(model=GENERATIVE_MODEL, history=past_history)
+    # Create a new chat session on the async client so requests don't block the event loop
+    return llm_client.aio.chats.create(model=GENERATIVE_MODEL, history=past_history)
 
-def generate_chat_response(chat_session: Chat, message: Dict) -> str:
+async def build_message_parts(message: Dict, results: Optional[Dict] = None) -> List:
     """
-    Generate a response using the chat session to maintain history.
-    Handles both text and image inputs.
+    Build the list of parts to send to the model for a user message.
+    Text messages are augmented with the chunks retrieved from the vector db.
     
     Args:
-        chat_session: The Vertex AI chat session
         message: Dict containing 'content' (text) and optionally 'image' (base64 string)
+        results: The chunks already retrieved for the message content, if any
     
     Returns:
-        str: The model's response
+        List: The message parts
     """
-    try:
-        collection = client.get_collection(name=collection_name) 
-        # Initialize parts list for the message
-        message_parts = []
-        
-        
-        # Process image if present
-        if message.get("image"):
-            try:
-                # Extract the actual base64 data and mime type
-                base64_string = message.get("image")
-                if ',' in base64_string:
-                    header, base64_data = base64_string.split(',', 1)
-                    mime_type = header.split(':')[1].split(';')[0]
-                else:
-                    base64_data = base64_string
-                    mime_type = 'image/jpeg'  # default to JPEG if no header
-                
-                # Decode base64 to bytes
-                image_bytes = base64.b64decode(base64_data)
-                
-                # Create an image Part using FileData
-                image_part = Part.from_bytes(data=image_bytes, mime_type=mime_type)
-                message_parts.append(image_part)
-
-                # Add text content if present
-                if message.get("content"):
-                    message_parts.append(message["content"])
-                else:
-                    message_parts.append("Name the cheese in the image, no descriptions needed")
-                
-            except ValueError as e:
-                print(f"Error processing image: {str(e)}")
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Image processing failed: {str(e)}"
-                )
-        elif message.get("image_path"):
-            # Read the image file
-            image_path = os.path.join("chat-history","llm-rag",message.get("image_path"))
-            with Path(image_path).open('rb') as f:
-                image_bytes = f.read()
-
-            # Determine MIME type based on file extension
-            mime_type = {
-                '.jpg': 'image/jpeg',
-                '.jpeg': 'image/jpeg',
-                '.png': 'image/png',
-                '.gif': 'image/gif'
-            }.get(Path(image_path).suffix.lower(), 'image/jpeg')
-
+    # Initialize parts list for the message
+    message_parts = []
+    
+    
+    # Process image if present
+    if message.get("image"):
+        try:
+            # Extract the actual base64 data and mime type
+            base64_string = message.get("image")
+            if ',' in base64_string:
+                header, base64_data = base64_string.split(',', 1)
+                mime_type = header.split(':')[1].split(';')[0]
+            else:
+                base64_data = base64_string
+                mime_type = 'image/jpeg'  # default to JPEG if no header
+            
+            # Decode base64 to bytes
+            image_bytes = base64.b64decode(base64_data)
+            
             # Create an image Part using FileData
             image_part = Part.from_bytes(data=image_bytes, mime_type=mime_type)
             message_parts.append(image_part)
@@ -148,28 +165,112 @@ def generate_chat_response(chat_session: Chat, message: Dict) -> str:
                 message_parts.append(message["content"])
             else:
                 message_parts.append("Name the cheese in the image, no descriptions needed")
+            
+        except ValueError as e:
+            print(f"Error processing image: {str(e)}")
+            raise HTTPException(
+                status_code=400,
+                detail=f"Image processing failed: {str(e)}"
+            )
+    elif message.get("image_path"):
+        # Read the image file
+        image_path = os.path.join("chat-history","llm-rag",message.get("image_path"))
+        with Path(image_path).open('rb') as f:
+            image_bytes = f.read()
+
+        # Determine MIME type based on file extension
+        mime_type = {
+            '.jpg': 'image/jpeg',
+            '.jpeg': 'image/jpeg',
+            '.png': 'image/png',
+            '.gif': 'image/gif'
+        }.get(Path(image_path).suffix.lower(), 'image/jpeg')
+
+        # Create an image Part using FileData
+        image_part = Part.from_bytes(data=image_bytes, mime_type=mime_type)
+        message_parts.append(image_part)
+
+        # Add text content if present
+        if message.get("content"):
+            message_parts.append(message["content"])
         else:
-            # Add text content if present
-            if message.get("content"):
-                # Create embeddings for the message content
-                query_embedding = generate_query_embedding(message["content"])
-                # Retrieve chunks based on embedding value 
-                results = collection.query(
-                    query_embeddings=[query_embedding],
-                    n_results=5
-                )
-                INPUT_PROMPT = f"""
-                {message["content"]}
-                {"\n".join(results["documents"][0])}
-                """
-                message_parts.append(INPUT_PROMPT)
-                    
-        
-        if not message_parts:
-            raise ValueError("Message must contain either text content or image")
+            message_parts.append("Name the cheese in the image, no descriptions needed")
+    else:
+        # Add text content if present
+        if message.get("content"):
+            if results is None:
+                _, results = await retrieve_chunks(message["content"])
+            INPUT_PROMPT = f"""
+            {message["content"]}
+            {"\n".join(results["documents"][0])}
+            """
+            message_parts.append(INPUT_PROMPT)
+                
+    
+    if not message_parts:
+        raise ValueError("Message must contain either text content or image")
+
+    return message_parts
+
+async def get_cached_response(chat_session: AsyncChat, message: Dict) -> Tuple[Optional[str], Optional[Tuple]]:
+    """
+    Look up a cached answer for the first question of a chat.
+
+    Returns:
+        Tuple: The cached answer or None, and the (query embedding, retrieved chunks)
+        computed for the lookup or None if the message is not cacheable
+    """
+    if (
+        not response_cache.enabled
+        or message.get("image")
+        or message.get("image_path")
+        or not message.get("content")
+        or chat_session.get_history()
+    ):
+        return None, None
+
+    retrieval = await retrieve_chunks(message["content"])
+    query_embedding, results = retrieval
+    answer = response_cache.get(query_embedding, results["ids"][0], collection.collection_id)
+    return answer, retrieval
+
+def cache_response(retrieval: Optional[Tuple], answer: str) -> None:
+    """Cache the answer to the first question of a chat"""
+    if retrieval is not None:
+        query_embedding, results = retrieval
+        response_cache.put(query_embedding, results["ids"][0], collection.collection_id, answer)
+
+def record_cached_turn(chat_session: AsyncChat, message_parts: List, answer: str) -> None:
+    """Add a turn answered from the cache to the chat session's history"""
+    chat_session.record_history(
+        user_input=types.UserContent(parts=[types.Part.from_text(text=part) for part in message_parts]),
+        model_output=[types.ModelContent(parts=[types.Part.from_text(text=answer)])],
+        automatic_function_calling_history=[],
+        is_valid=True,
+    )
+
+async def generate_chat_response(chat_session: AsyncChat, message: Dict) -> str:
+    """
+    Generate a response using the chat session to maintain history.
+    Handles both text and image inputs.
+    
+    Args:
+        chat_session: The Vertex AI chat session
+        message: Dict containing 'content' (text) and optionally 'image' (base64 string)
+    
+    Returns:
+        str: The model's response
+    """
+    try:
+        answer, retrieval = await get_cached_response(chat_session, message)
+        message_parts = await build_message_parts(message, retrieval and retrieval[1])
+        if answer is not None:
+            record_cached_turn(chat_session, message_parts, answer)
+            return answer
 
         # Send message with all parts to the model
-        response = chat_session.send_message(message_parts)
+        response = await chat_session.send_message(message_parts)
+        cache_response(retrieval, response.text)
         
         return response.text
         
@@ -181,7 +282,33 @@ def generate_chat_response(chat_session: Chat, message: Dict) -> str:
             detail=f"Failed to generate response: {str(e)}"
         )
 
-def rebuild_chat_session(chat_history: List[Dict]) -> Chat:
+async def generate_chat_response_stream(chat_session: AsyncChat, message: Dict) -> AsyncIterator[str]:
+    """
+    Generate a response using the chat session, yielding text deltas as they arrive.
+    
+    Args:
+        chat_session: The Vertex AI chat session
+        message: Dict containing 'content' (text) and optionally 'image' (base64 string)
+    
+    Yields:
+        str: The next chunk of the model's response
+    """
+    answer, retrieval = await get_cached_response(chat_session, message)
+    message_parts = await build_message_parts(message, retrieval and retrieval[1])
+    if answer is not None:
+        record_cached_turn(chat_session, message_parts, answer)
+        yield answer
+        return
+
+    # Stream the response from the model
+    chunks = []
+    async for chunk in await chat_session.send_message_stream(message_parts):
+        if chunk.text:
+            chunks.append(chunk.text)
+            yield chunk.text
+    cache_response(retrieval, "".join(chunks))
+
+def rebuild_chat_session(chat_history: List[Dict]) -> AsyncChat:
     """Rebuild a chat session with complete context"""
 
     formatted_history = []
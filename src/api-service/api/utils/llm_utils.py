@@ -1,5 +1,5 @@
 import os
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator
 from fastapi import HTTPException
 import base64
 import io
@@ -12,7 +12,9 @@ from google import genai
 from google.genai import types
 from google.genai.types import Content, Part, GenerationConfig, ToolConfig
 from google.genai import errors
-from google.genai.chats import Chat
+from google.genai.chats import AsyncChat
+
+from api.utils.session_cache import ChatSessionCache
 
 # Setup
 GCP_PROJECT = os.environ["GCP_PROJECT"]
@@ -44,77 +46,43 @@ Your goal is to provide accurate, helpful information about cheese for each quer
 """
 
 # Initialize chat sessions
-chat_sessions: Dict[str, Chat] = {}
+chat_sessions = ChatSessionCache()
 
 
-def create_chat_session(past_history=None) -> Chat:
+def create_chat_session(past_history=None) -> AsyncChat:
     """Create a new chat session with the model"""
-    # Create a new chat session
-    return llm_client.chats.create(model=GENERATIVE_MODEL, history=past_history)
+    # Create a new chat session on the async client so requests don't block the event loop
+    return llm_client.aio.chats.create(model=GENERATIVE_MODEL, history=past_history)
 
 
-def generate_chat_response(chat_session: Chat, message: Dict) -> str:
+def build_message_parts(message: Dict) -> List:
     """
-    Generate a response using the chat session to maintain history.
+    Build the list of parts to send to the model for a user message.
     Handles both text and image inputs.
 
     Args:
-        chat_session: The Vertex AI chat session
         message: Dict containing 'content' (text) and optionally 'image' (base64 string)
 
     Returns:
-        str: The model's response
+        List: The message parts
     """
+    # Initialize parts list for the message
+    message_parts = []
+
+    # Process image if present
+    if message.get("image"):
+        try:
+            # Extract the actual base64 data and mime type
+            base64_string = message.get("image")
+            if "," in base64_string:
+                header, base64_data = base64_string.split(",", 1)
+                mime_type = header.split(":")[1].split(";")[0]
+            else:
+                base64_data = base64_string
+                mime_type = "image/jpeg"  # default to JPEG if no header
 
-    try:
-        # Initialize parts list for the message
-        message_parts = []
-
-        # Process image if present
-        if message.get("image"):
-            try:
-                # Extract the actual base64 data and mime type
-                base64_string = message.get("image")
-                if "," in base64_string:
-                    header, base64_data = base64_string.split(",", 1)
-                    mime_type = header.split(":")[1].split(";")[0]
-                else:
-                    base64_data = base64_string
-                    mime_type = "image/jpeg"  # default to JPEG if no header
-
-                # Decode base64 to bytes
-                image_bytes = base64.b64decode(base64_data)
-
-                # Create an image Part using FileData
-                image_part = Part.from_bytes(data=image_bytes, mime_type=mime_type)
-                message_parts.append(image_part)
-
-                # Add text content if present
-                if message.get("content"):
-                    message_parts.append(message["content"])
-                else:
-                    message_parts.append(
-                        "Name the cheese in the image, no descriptions needed"
-                    )
-
-            except ValueError as e:
-                print(f"Error processing image: {str(e)}")
-                raise HTTPException(
-                    status_code=400, detail=f"Image processing failed: {str(e)}"
-                )
-        elif message.get("image_path"):
-            # Read the image file
-            image_path = os.path.join("chat-history", "llm", message.get("image_path"))
-            with Path(image_path).open("rb") as f:
-                image_bytes = f.read()
-
-            # Determine MIME type based on file extension
-            mime_type = {
-                ".jpg": "image/jpeg",
-                ".jpeg": "image/jpeg",
-                ".png": "image/png",
-                ".gif": "image/gif",
-            }.get(Path(image_path).suffix.lower(), "image/jpeg")
+            # Decode base64 to bytes
+            image_bytes = base64.b64decode(base64_data)
 
             # Create an image Part using FileData
             image_part = Part.from_bytes(data=image_bytes, mime_type=mime_type)
@@ -127,16 +95,66 @@ def generate_chat_response(chat_session: Chat, message: Dict) -> str:
                 message_parts.append(
                     "Name the cheese in the image, no descriptions needed"
                 )
+
+        except ValueError as e:
+            print(f"Error processing image: {str(e)}")
+            raise HTTPException(
+                status_code=400, detail=f"Image processing failed: {str(e)}"
+            )
+    elif message.get("image_path"):
+        # Read the image file
+        image_path = os.path.join("chat-history", "llm", message.get("image_path"))
+        with Path(image_path).open("rb") as f:
+            image_bytes = f.read()
+
+        # Determine MIME type based on file extension
+        mime_type = {
+            ".jpg": "image/jpeg",
+            ".jpeg": "image/jpeg",
+            ".png": "image/png",
+            ".gif": "image/gif",
+        }.get(Path(image_path).suffix.lower(), "image/jpeg")
+
+        # Create an image Part using FileData
+        image_part = Part.from_bytes(data=image_bytes, mime_type=mime_type)
+        message_parts.append(image_part)
+
+        # Add text content if present
+        if message.get("content"):
+            message_parts.append(message["content"])
         else:
-            # Add text content if present
-            if message.get("content"):
-                message_parts.append(message["content"])
+            message_parts.append(
+                "Name the cheese in the image, no descriptions needed"
+            )
+    else:
+        # Add text content if present
+        if message.get("content"):
+            message_parts.append(message["content"])
+
+    if not message_parts:
+        raise ValueError("Message must contain either text content or image")
+
+    return message_parts
 
-        if not message_parts:
-            raise ValueError("Message must contain either text content or image")
+
+async def generate_chat_response(chat_session: AsyncChat, message: Dict) -> str:
+    """
+    Generate a response using the chat session to maintain history.
+    Handles both text and image inputs.
+
+    Args:
+        chat_session: The Vertex AI chat session
+        message: Dict containing 'content' (text) and optionally 'image' (base64 string)
+
+    Returns:
+        str: The model's response
+    """
+
+    try:
+        message_parts = build_message_parts(message)
 
         # Send message with all parts to the model
-        response = chat_session.send_message(message_parts)
+        response = await chat_session.send_message(message_parts)
 
         return response.text
 
@@ -148,7 +166,28 @@ def generate_chat_response(chat_session: Chat, message: Dict) -> str:
         )
 
 
-def rebuild_chat_session(chat_history: List[Dict]) -> Chat:
+async def generate_chat_response_stream(
+    chat_session: AsyncChat, message: Dict
+) -> AsyncIterator[str]:
+    """
+    Generate a response using the chat session, yielding text deltas as they arrive.
+
+    Args:
+        chat_session: The Vertex AI chat session
+        message: Dict containing 'content' (text) and optionally 'image' (base64 string)
+
+    Yields:
+        str: The next chunk of the model's response
+    """
+    message_parts = build_message_parts(message)
+
+    # Stream the response from the model
+    async for chunk in await chat_session.send_message_stream(message_parts):
+        if chunk.text:
+            yield chunk.text
+
+
+def rebuild_chat_session(chat_history: List[Dict]) -> AsyncChat:
     """Rebuild a chat session with complete context"""
 
     formatted_history = []
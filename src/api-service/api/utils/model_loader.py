@@ -0,0 +1,113 @@
+import asyncio
+import os
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Optional
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+# Seconds a request waits for a model that is still loading before a 503
+MODEL_READY_TIMEOUT = float(os.getenv("MODEL_READY_TIMEOUT", "30"))
+
+
+class BackgroundLoader:
+    """
+    Loads a model off the request path.
+
+    start() runs load in the threadpool as a background task, so the app starts
+    serving straight away, e.g. from the FastAPI lifespan. Requests that need the
+    model await wait_ready(), which starts the load if nothing did yet and raises
+    a 503 with a Retry-After header when the model is not ready in time or failed
+    to load. A failed load is retried by the next start() or wait_ready().
+
+    ensure_loaded() loads the model in the calling thread, for scripts and
+    synchronous callers. The load itself only ever runs once at a time.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        load: Callable[[], None],
+        ready_timeout: float = MODEL_READY_TIMEOUT,
+    ):
+        self.name = name
+        self.load = load
+        self.ready_timeout = ready_timeout
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def ensure_loaded(self) -> None:
+        """Load the model in this thread unless it is already loaded"""
+        with self._lock:
+            if self.ready:
+                return
+            self.state = "loading"
+            self.error = None
+            start = time.perf_counter()
+            try:
+                self.load()
+            except Exception as e:
+                self.state = "failed"
+                self.error = str(e)
+                raise
+            self.load_seconds = round(time.perf_counter() - start, 2)
+            self.state = "ready"
+            print(f"{self.name} model loaded in {self.load_seconds}s")
+
+    async def _run(self) -> None:
+        try:
+            await run_in_threadpool(self.ensure_loaded)
+        except Exception as e:
+            print(f"Error loading the {self.name} model: {str(e)}")
+            traceback.print_exc()
+
+    def start(self) -> asyncio.Task:
+        """Start loading in the background, unless it is loaded or already loading"""
+        loop = asyncio.get_running_loop()
+        if self.ready or (
+            self._task is not None
+            and not self._task.done()
+            and self._task.get_loop() is loop
+        ):
+            return self._task
+        self._task = loop.create_task(self._run())
+        return self._task
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> None:
+        """Wait for the model, raises a 503 if it is not ready within timeout seconds"""
+        if self.ready:
+            return
+        task = self.start()
+        try:
+            # Shield the load, a request giving up must not cancel it
+            await asyncio.wait_for(
+                asyncio.shield(task),
+                self.ready_timeout if timeout is None else timeout,
+            )
+        except asyncio.TimeoutError:
+            pass
+        if not self.ready:
+            detail = f"The {self.name} model is still loading, try again shortly"
+            if self.state == "failed":
+                detail = f"The {self.name} model failed to load: {self.error}"
+            raise HTTPException(
+                status_code=503, detail=detail, headers={"Retry-After": "5"}
+            )
+
+    def status(self) -> Dict:
+        return {
+            "model": self.name,
+            "state": self.state,
+            "ready": self.ready,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
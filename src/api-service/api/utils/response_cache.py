@@ -0,0 +1,134 @@
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+# Opt-in, answers are only reused when RAG_RESPONSE_CACHE is enabled
+RAG_RESPONSE_CACHE = os.getenv("RAG_RESPONSE_CACHE", "0").lower() in ("1", "true", "yes")
+# Minimum cosine similarity between query embeddings to reuse an answer
+RAG_RESPONSE_CACHE_THRESHOLD = float(os.getenv("RAG_RESPONSE_CACHE_THRESHOLD", "0.97"))
+RAG_RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RAG_RESPONSE_CACHE_TTL_SECONDS", "86400"))
+RAG_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RAG_RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+
+# Answers kept per set of retrieved chunks
+MAX_ANSWERS_PER_CHUNKS = 8
+
+
+def _normalize(vector: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class SemanticResponseCache:
+    """
+    Cache of first-turn RAG answers.
+
+    An answer is reused for a new question when the vector db retrieved exactly
+    the same chunks for it and its query embedding is within the cosine similarity
+    threshold of the cached question's. Answers expire after ttl_seconds, and the
+    whole cache is dropped when the collection is reloaded (its id changes).
+
+    Answers are grouped by their retrieved chunk ids, the least recently used
+    groups are evicted beyond max_entries answers.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = RAG_RESPONSE_CACHE,
+        threshold: float = RAG_RESPONSE_CACHE_THRESHOLD,
+        ttl_seconds: int = RAG_RESPONSE_CACHE_TTL_SECONDS,
+        max_entries: int = RAG_RESPONSE_CACHE_MAX_ENTRIES,
+    ):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # chunk ids -> [(normalised query embedding, answer, created)], least recent first
+        self._groups: "OrderedDict[tuple, list]" = OrderedDict()
+        self._size = 0
+        self._collection_id: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _check_collection(self, collection_id: Optional[str]) -> None:
+        """Drop every answer if the collection was reloaded"""
+        if collection_id != self._collection_id:
+            self.clear()
+            self._collection_id = collection_id
+
+    def get(
+        self,
+        query_embedding: Sequence[float],
+        chunk_ids: Sequence[str],
+        collection_id: Optional[str],
+    ) -> Optional[str]:
+        """Get a cached answer for a question, None on a miss"""
+        self._check_collection(collection_id)
+        key = tuple(chunk_ids)
+        entries = self._groups.get(key)
+        if entries:
+            cutoff = time.time() - self.ttl_seconds
+            fresh = [entry for entry in entries if entry[2] >= cutoff]
+            self._size -= len(entries) - len(fresh)
+            if fresh:
+                self._groups[key] = fresh
+                self._groups.move_to_end(key)
+            else:
+                del self._groups[key]
+
+            query = _normalize(query_embedding)
+            best = max(
+                fresh,
+                key=lambda entry: sum(a * b for a, b in zip(entry[0], query)),
+                default=None,
+            )
+            if best is not None:
+                similarity = sum(a * b for a, b in zip(best[0], query))
+                if similarity >= self.threshold:
+                    self.hits += 1
+                    return best[1]
+
+        self.misses += 1
+        return None
+
+    def put(
+        self,
+        query_embedding: Sequence[float],
+        chunk_ids: Sequence[str],
+        collection_id: Optional[str],
+        answer: str,
+    ) -> None:
+        """Cache the answer to a question"""
+        if not answer:
+            return
+        self._check_collection(collection_id)
+        key = tuple(chunk_ids)
+        entries = self._groups.setdefault(key, [])
+        entries.append((_normalize(query_embedding), answer, time.time()))
+        self._size += 1
+        if len(entries) > MAX_ANSWERS_PER_CHUNKS:
+            entries.pop(0)
+            self._size -= 1
+        self._groups.move_to_end(key)
+
+        while self._size > self.max_entries and len(self._groups) > 1:
+            _, evicted = self._groups.popitem(last=False)
+            self._size -= len(evicted)
+
+    def clear(self) -> None:
+        self._groups.clear()
+        self._size = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
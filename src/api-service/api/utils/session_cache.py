@@ -0,0 +1,136 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from google.genai.chats import AsyncChat
+
+# Cache limits, can be overridden from the environment
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "1000"))
+SESSION_CACHE_MAX_HISTORY_BYTES = int(
+    os.getenv("SESSION_CACHE_MAX_HISTORY_BYTES", str(256 * 1024 * 1024))
+)
+SESSION_CACHE_TTL_SECONDS = int(os.getenv("SESSION_CACHE_TTL_SECONDS", "3600"))
+
+
+def estimate_history_size(chat_session: AsyncChat) -> int:
+    """Approximate the memory held by a chat session's history in bytes"""
+    size = 0
+    for content in chat_session.get_history(curated=False):
+        for part in content.parts or []:
+            if part.text:
+                size += len(part.text)
+            if part.inline_data and part.inline_data.data:
+                size += len(part.inline_data.data)
+    return size
+
+
+class ChatSessionCache:
+    """
+    LRU cache of live chat sessions keyed by chat id.
+
+    Sessions are evicted when they have been idle for longer than the TTL, when
+    the number of sessions exceeds max_entries, or when the combined history size
+    exceeds max_history_bytes, including a single session larger than the limit.
+    An evicted session is rebuilt from the saved chat history with
+    rebuild_chat_session on the next request for that chat.
+
+    A session's history size is measured when it is stored, so callers store the
+    session again once a turn completes to account for the grown history.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SESSION_CACHE_MAX_ENTRIES,
+        max_history_bytes: int = SESSION_CACHE_MAX_HISTORY_BYTES,
+        ttl_seconds: int = SESSION_CACHE_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.max_history_bytes = max_history_bytes
+        self.ttl_seconds = ttl_seconds
+        # chat_id -> (session, history size, last access time), least recent first
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._history_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, chat_id: str, default=None) -> Optional[AsyncChat]:
+        """Get a session, counting the lookup as a hit or miss"""
+        self._expire()
+        entry = self._sessions.get(chat_id)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        # Mark as recently used, the size is re-measured when the turn is stored
+        self._sessions[chat_id] = (entry[0], entry[1], time.monotonic())
+        self._sessions.move_to_end(chat_id)
+        return entry[0]
+
+    def __setitem__(self, chat_id: str, chat_session: AsyncChat) -> None:
+        self._store(chat_id, chat_session)
+        self._expire()
+        self._evict()
+
+    def __contains__(self, chat_id: str) -> bool:
+        return chat_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def pop(self, chat_id: str, default=None) -> Optional[AsyncChat]:
+        """Remove a session from the cache"""
+        entry = self._sessions.pop(chat_id, None)
+        if entry is None:
+            return default
+        self._history_bytes -= entry[1]
+        return entry[0]
+
+    def clear(self) -> None:
+        self._sessions.clear()
+        self._history_bytes = 0
+
+    def stats(self) -> Dict:
+        """Cache counters used to size the cache"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._sessions),
+            "history_bytes": self._history_bytes,
+            "max_entries": self.max_entries,
+            "max_history_bytes": self.max_history_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _store(self, chat_id: str, chat_session: AsyncChat) -> None:
+        previous = self._sessions.pop(chat_id, None)
+        if previous is not None:
+            self._history_bytes -= previous[1]
+        size = estimate_history_size(chat_session)
+        self._sessions[chat_id] = (chat_session, size, time.monotonic())
+        self._history_bytes += size
+
+    def _expire(self) -> None:
+        """Drop sessions that have been idle for longer than the TTL"""
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._sessions:
+            chat_id, (_, _, last_access) = next(iter(self._sessions.items()))
+            if last_access >= cutoff:
+                break
+            self.pop(chat_id)
+            self.evictions += 1
+
+    def _evict(self) -> None:
+        """Drop least recently used sessions until the cache is within its limits"""
+        while self._sessions and (
+            len(self._sessions) > self.max_entries
+            or self._history_bytes > self.max_history_bytes
+        ):
+            chat_id = next(iter(self._sessions))
+            self.pop(chat_id)
+            self.evictions += 1
@@ -0,0 +1,151 @@
+"""
+Benchmark concurrent GET /chats latency with the blocking ChatHistoryManager
+called directly in async handlers vs the AsyncChatHistoryManager.
+
+Run from src/api-service:
+    python -m benchmarks.chat_history_benchmark --requests 400 --concurrency 20
+
+--io-latency-ms adds a sleep to every chat history file read to emulate a
+network attached persistent disk.
+"""
+
+import argparse
+import asyncio
+import statistics
+import multiprocessing
+import tempfile
+import time
+import uuid
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Header
+
+from api.utils import chat_storage, chat_utils
+
+
+def seed_chats(manager, session_id, num_chats, num_messages):
+    for i in range(num_chats):
+        manager.save_chat(
+            {
+                "chat_id": str(uuid.uuid4()),
+                "title": f"Chat {i}...",
+                "dts": int(time.time()) - i,
+                "messages": [
+                    {
+                        "message_id": str(uuid.uuid4()),
+                        "role": "user" if m % 2 == 0 else "assistant",
+                        "content": "Tell me about aged gouda. " * 20,
+                    }
+                    for m in range(num_messages)
+                ],
+            },
+            session_id,
+        )
+
+
+def create_app(sync_manager, async_manager):
+    app = FastAPI()
+
+    @app.get("/sync/chats")
+    async def get_chats_sync(
+        x_session_id: str = Header(None, alias="X-Session-ID"), limit: int = 20
+    ):
+        return sync_manager.get_recent_chats(x_session_id, limit)
+
+    @app.get("/async/chats")
+    async def get_chats_async(
+        x_session_id: str = Header(None, alias="X-Session-ID"), limit: int = 20
+    ):
+        return await async_manager.get_recent_chats(x_session_id, limit)
+
+    return app
+
+
+def start_server(app, port):
+    """Serve the app from a separate process so the client does not share its GIL"""
+    server = multiprocessing.Process(
+        target=uvicorn.run,
+        args=(app,),
+        kwargs={"host": "127.0.0.1", "port": port, "log_level": "warning"},
+        daemon=True,
+    )
+    server.start()
+    while True:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+
+
+async def run(base_url, path, session_id, num_requests, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+
+        async def request():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(
+                    path, headers={"X-Session-ID": session_id}
+                )
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        # Warm up the connection pool
+        await asyncio.gather(*(request() for _ in range(concurrency)))
+        latencies.clear()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(num_requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+        "rps": num_requests / elapsed,
+    }
+
+
+def main(args):
+    chat_utils.persistent_dir = tempfile.mkdtemp()
+    session_id = str(uuid.uuid4())
+    sync_manager = chat_utils.ChatHistoryManager(model="bench")
+    async_manager = chat_utils.AsyncChatHistoryManager(model="bench")
+    seed_chats(sync_manager, session_id, args.chats, args.messages)
+
+    if args.io_latency_ms:
+        read_file = chat_storage.FileChatStorage._read_file
+
+        def slow_read_file(self, path):
+            time.sleep(args.io_latency_ms / 1000)
+            return read_file(self, path)
+
+        chat_storage.FileChatStorage._read_file = slow_read_file
+
+    server = start_server(create_app(sync_manager, async_manager), args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+    for name in ("sync", "async"):
+        result = asyncio.run(
+            run(base_url, f"/{name}/chats", session_id, args.requests, args.concurrency)
+        )
+        print(
+            f"{name:>5}: p50 {result['p50']:8.2f} ms  p99 {result['p99']:8.2f} ms  "
+            f"{result['rps']:8.1f} req/s"
+        )
+    server.terminate()
+    server.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat history benchmark")
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--io-latency-ms", type=float, default=10)
+    parser.add_argument("--port", type=int, default=9100)
+    main(parser.parse_args())
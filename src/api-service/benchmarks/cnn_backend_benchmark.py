@@ -0,0 +1,177 @@
+"""
+Compare the CNN inference backends: the compiled Keras model on TensorFlow vs
+the models exported by cli.py --export run by TFLite (LiteRT) and ONNX Runtime.
+
+Run from src/api-service:
+    python -m benchmarks.cnn_backend_benchmark --model /persistent/experiments/experiment_1760994796/mobilenetv2_train_base_True.keras
+
+Every backend is measured in a fresh process that loads the model and preprocesses
+a JPEG the way the service does (cnn_runtime.preprocess_image), so the load time
+and peak memory (RSS) include importing the runtime and the preprocessing, and
+TensorFlow only for keras. Preprocessing is timed per image, separately from the
+forward pass.
+The exported models are expected next to the .keras file, as cli.py writes them.
+Without --model a randomly initialised MobileNetV2 is saved and exported to a
+temporary folder first (the ONNX export needs tf2onnx).
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+from PIL import Image
+
+from api.utils.cnn_runtime import runtime_model_path
+
+INPUT_SHAPE = (224, 224, 3)
+VARIANTS = [
+    ("keras", ""),
+    ("tflite", ""),
+    ("tflite", "float16"),
+    ("tflite", "int8"),
+    ("onnx", ""),
+    ("onnx", "int8"),
+]
+
+
+def prepare_model(folder):
+    """Save a random MobileNetV2 and export it for every backend"""
+    import tensorflow as tf
+
+    from api.utils.cnn_inference import export_onnx, export_tflite
+
+    model = tf.keras.applications.MobileNetV2(
+        input_shape=INPUT_SHAPE, weights=None, classes=10
+    )
+    model_path = os.path.join(folder, "mobilenetv2.keras")
+    model.save(model_path)
+    calibration_images = np.random.default_rng(0).random((16, *INPUT_SHAPE), dtype=np.float32)
+    for backend, quantization in VARIANTS[1:]:
+        output_path = runtime_model_path(model_path, backend, quantization)
+        try:
+            if backend == "tflite":
+                export_tflite(model, output_path, quantization, calibration_images)
+            else:
+                export_onnx(model, output_path, quantization)
+        except RuntimeError as e:
+            print(f"Skipping {backend} {quantization}: {str(e)}")
+    return model_path
+
+
+def encoded_image():
+    """A 640x480 JPEG, about the size of a phone photo sent to /llm-cnn"""
+    pixels = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def measure_backend(backend, model_path, batch_sizes, number, results):
+    image_bytes = encoded_image()
+
+    # Load and preprocess like llm_cnn_utils does for the backend
+    start = time.perf_counter()
+    from api.utils.cnn_runtime import load_runtime_model, preprocess_image
+
+    if backend == "keras":
+        import tensorflow as tf
+
+        from api.utils.cnn_inference import compile_inference
+
+        predict = compile_inference(tf.keras.models.load_model(model_path), INPUT_SHAPE)
+    else:
+        predict = load_runtime_model(backend, model_path)
+
+    image = preprocess_image(image_bytes, backend)
+    images = np.stack([image] * max(batch_sizes))
+    predict(images[:1])
+    load_seconds = time.perf_counter() - start
+
+    preprocess_ms = (
+        min(
+            timeit.repeat(
+                lambda: preprocess_image(image_bytes, backend), number=number, repeat=5
+            )
+        )
+        / number
+        * 1000
+    )
+
+    latencies = {}
+    for batch_size in batch_sizes:
+        batch = images[:batch_size]
+        predict(batch)
+        best = min(timeit.repeat(lambda: predict(batch), number=number, repeat=5))
+        latencies[batch_size] = best / number / batch_size * 1000
+
+    results.put(
+        {
+            "load_seconds": load_seconds,
+            # ru_maxrss is in kilobytes on Linux
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "latencies": latencies,
+            "preprocess_ms": preprocess_ms,
+            "tensorflow": "tensorflow" in sys.modules,
+            "size_mb": os.path.getsize(model_path) / 1e6,
+        }
+    )
+
+
+def main(args):
+    context = multiprocessing.get_context("spawn")
+
+    with tempfile.TemporaryDirectory() as folder:
+        model_path = args.model
+        if model_path is None:
+            with context.Pool(1) as pool:
+                model_path = pool.apply(prepare_model, (folder,))
+
+        print(
+            f"{'backend':>16} {'size MB':>8} {'load s':>7} {'peak RSS MB':>12} "
+            f"{'TF':>4} {'preprocess ms':>14}  "
+            + "  ".join(f"batch {batch_size:>2} ms/img" for batch_size in args.batch_sizes)
+        )
+        for backend, quantization in VARIANTS:
+            path = model_path
+            if backend != "keras":
+                path = runtime_model_path(model_path, backend, quantization)
+            if not os.path.exists(path):
+                continue
+
+            results = context.Queue()
+            process = context.Process(
+                target=measure_backend,
+                args=(backend, path, args.batch_sizes, args.number, results),
+            )
+            process.start()
+            process.join()
+            name = f"{backend} {quantization}".strip()
+            if process.exitcode != 0:
+                print(f"{name:>16} failed, see the error above")
+                continue
+            result = results.get()
+
+            print(
+                f"{name:>16} {result['size_mb']:8.1f} {result['load_seconds']:7.2f} "
+                f"{result['peak_rss_mb']:12.0f} "
+                f"{'yes' if result['tensorflow'] else 'no':>4} {result['preprocess_ms']:14.2f}  "
+                + "  ".join(
+                    f"{result['latencies'][batch_size]:16.2f}"
+                    for batch_size in args.batch_sizes
+                )
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CNN inference backend benchmark")
+    parser.add_argument("--model", default=None, help="Path to the .keras model")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--number", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,104 @@
+"""
+Load-test CNN inference with one forward pass per request, as /llm-cnn/chats did
+before, vs the MicroBatcher gathering concurrent requests into micro-batches.
+
+Run from src/api-service:
+    python -m benchmarks.cnn_batching_benchmark --requests 256 --concurrency 32
+
+--model points at the trained .keras model (e.g. /persistent/experiments/
+experiment_1760994796/mobilenetv2_train_base_True.keras). Without it a randomly
+initialised MobileNetV2 of the same input size is used, which has the same cost.
+
+Each of --concurrency clients sends its next request as soon as the previous one
+returns, the report shows throughput and per-request latency percentiles.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import numpy as np
+import tensorflow as tf
+from fastapi.concurrency import run_in_threadpool
+
+from api.utils.inference_batcher import MicroBatcher
+
+
+def load_model(model_path):
+    if model_path:
+        return tf.keras.models.load_model(model_path)
+    return tf.keras.applications.MobileNetV2(
+        input_shape=(224, 224, 3), weights=None, classes=10
+    )
+
+
+async def run_load(predict, images, num_requests, concurrency):
+    """Closed-loop load, returns the wall time and the latency of every request"""
+    latencies = []
+    remaining = iter(range(num_requests))
+
+    async def client():
+        for i in remaining:
+            start = time.perf_counter()
+            await predict(images[i % len(images)])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return time.perf_counter() - start, latencies
+
+
+def report(name, wall_time, latencies, extra=""):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{name:>10}: {len(latencies) / wall_time:7.1f} img/s  "
+        f"p50 {p50:7.1f} ms  p95 {p95:7.1f} ms{extra}"
+    )
+
+
+async def main(args):
+    model = load_model(args.model)
+    rng = np.random.default_rng(0)
+    images = rng.random((32, 224, 224, 3), dtype=np.float32)
+
+    def predict_batch(batch):
+        return model.predict(batch, verbose=0)
+
+    # Warm up both batch shapes before timing
+    predict_batch(images[:1])
+    predict_batch(images[: args.max_batch_size])
+
+    async def predict_single(image):
+        return await run_in_threadpool(predict_batch, image[np.newaxis])
+
+    batcher = MicroBatcher(
+        predict_batch, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms
+    )
+
+    print(
+        f"{args.requests} requests, concurrency {args.concurrency}, "
+        f"max batch {args.max_batch_size}, max wait {args.max_wait_ms} ms"
+    )
+    wall_time, latencies = await run_load(
+        predict_single, images, args.requests, args.concurrency
+    )
+    report("unbatched", wall_time, latencies)
+
+    wall_time, latencies = await run_load(
+        batcher.predict, images, args.requests, args.concurrency
+    )
+    stats = batcher.stats()
+    report("batched", wall_time, latencies, f"  avg batch {stats['average_batch_size']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CNN micro-batching load benchmark")
+    parser.add_argument("--model", default=None, help="Path to a .keras model")
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,70 @@
+"""
+Micro-benchmark per-image CNN latency with model.predict, as make_prediction
+called it before, vs the warmed-up tf.function from compile_inference called
+directly.
+
+Run from src/api-service:
+    python -m benchmarks.cnn_inference_benchmark --batch-sizes 1 8 16
+
+--model points at the trained .keras model (e.g. /persistent/experiments/
+experiment_1760994796/mobilenetv2_train_base_True.keras). Without it a randomly
+initialised MobileNetV2 of the same input size is used.
+"""
+
+import argparse
+import time
+import timeit
+
+import numpy as np
+import tensorflow as tf
+
+from api.utils.cnn_inference import compile_inference
+
+INPUT_SHAPE = (224, 224, 3)
+
+
+def load_model(model_path):
+    if model_path:
+        return tf.keras.models.load_model(model_path)
+    return tf.keras.applications.MobileNetV2(
+        input_shape=INPUT_SHAPE, weights=None, classes=10
+    )
+
+
+def measure(func, number):
+    """Best of 5 runs, in milliseconds per call"""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1000
+
+
+def main(args):
+    model = load_model(args.model)
+
+    start = time.perf_counter()
+    predict = compile_inference(model, INPUT_SHAPE, warmup_batch_sizes=args.batch_sizes)
+    print(f"compile and warm-up: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    rng = np.random.default_rng(0)
+    for batch_size in args.batch_sizes:
+        images = rng.random((batch_size, *INPUT_SHAPE), dtype=np.float32)
+        model.predict(images, verbose=0)
+
+        # Both paths must give the same outputs
+        np.testing.assert_allclose(
+            model.predict(images, verbose=0), predict(images), rtol=1e-4, atol=1e-5
+        )
+
+        predict_ms = measure(lambda: model.predict(images, verbose=0), args.number)
+        compiled_ms = measure(lambda: predict(images), args.number)
+        print(
+            f"batch {batch_size:>3}: model.predict {predict_ms / batch_size:7.2f} ms/image  "
+            f"compiled {compiled_ms / batch_size:7.2f} ms/image  "
+            f"{predict_ms / compiled_ms:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CNN inference latency benchmark")
+    parser.add_argument("--model", default=None, help="Path to a .keras model")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 16])
+    parser.add_argument("--number", type=int, default=10)
+    main(parser.parse_args())
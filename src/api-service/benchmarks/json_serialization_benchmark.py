@@ -0,0 +1,101 @@
+"""
+Micro-benchmark chat JSON serialisation with the stdlib json module vs orjson,
+over chats of realistic size (200 messages by default).
+
+Run from src/api-service:
+    python -m benchmarks.json_serialization_benchmark --messages 200
+
+Compares:
+    chat file:  json.dumps(indent=2) / json.loads of the whole chat, as chats were
+                saved before, vs the orjson JSONL message log of FileChatStorage
+    response:   jsonable_encoder + JSONResponse vs ORJSONResponse for GET /chats/{id}
+"""
+
+import argparse
+import json
+import time
+import timeit
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from api.utils.chat_storage import dumps_json, loads_json
+
+USER_MESSAGE = "How does the aging time change the flavour of Gruyère and Comté? "
+ASSISTANT_MESSAGE = (
+    "## Aging and flavour\n\n"
+    "Young Gruyère (5-6 months) is **creamy and nutty**, while *réserve* wheels "
+    "aged 10-16 months develop crunchy tyrosine crystals and a deeper, brothy "
+    "taste. Comté follows a similar curve:\n\n"
+    "- 4-8 months: milky, buttery, hints of hazelnut\n"
+    "- 12-18 months: roasted nuts, brown butter, fruit\n"
+    "- 24+ months: intense, savoury, almost meaty\n\n"
+)
+
+
+def make_chat(num_messages):
+    messages = []
+    for i in range(num_messages):
+        message = {"message_id": str(uuid.uuid4())}
+        if i % 2 == 0:
+            message["role"] = "user"
+            message["content"] = USER_MESSAGE * 2
+            if i % 20 == 0:
+                message["image_path"] = f"images/chat/{message['message_id']}.png"
+        else:
+            message["role"] = "assistant"
+            message["content"] = ASSISTANT_MESSAGE * 3
+        messages.append(message)
+
+    return {
+        "chat_id": str(uuid.uuid4()),
+        "title": USER_MESSAGE[:50] + "...",
+        "dts": int(time.time()),
+        "messages": messages,
+    }
+
+
+def measure(func, number):
+    """Best of 5 runs, in milliseconds per call"""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1000
+
+
+def main(args):
+    chat = make_chat(args.messages)
+    indented = json.dumps(chat, indent=2)
+    log = "".join(dumps_json(message) + "\n" for message in chat["messages"])
+
+    cases = [
+        (
+            "chat file write",
+            lambda: json.dumps(chat, indent=2),
+            lambda: "".join(dumps_json(message) + "\n" for message in chat["messages"]),
+        ),
+        (
+            "chat file read",
+            lambda: json.loads(indented),
+            lambda: loads_json("[" + log.rstrip("\n").replace("\n", ",") + "]"),
+        ),
+        (
+            "chat response",
+            lambda: JSONResponse(jsonable_encoder(chat)),
+            lambda: ORJSONResponse(chat),
+        ),
+    ]
+
+    print(f"{args.messages} messages, {len(indented) / 1024:.0f} KB as indented JSON")
+    for name, before, after in cases:
+        before_ms = measure(before, args.number)
+        after_ms = measure(after, args.number)
+        print(
+            f"{name:>16}: json {before_ms:7.3f} ms  orjson {after_ms:7.3f} ms  "
+            f"{before_ms / after_ms:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat JSON serialisation benchmark")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--number", type=int, default=100)
+    main(parser.parse_args())
@@ -0,0 +1,204 @@
+"""
+Module that contains the command line app.
+
+Typical usage example from command line:
+        python cli.py --export --backend onnx --parity
+        python cli.py --export --backend tflite --quantize float16 --parity
+"""
+
+import os
+import argparse
+import json
+import numpy as np
+import tensorflow as tf
+
+from api.utils.cnn_inference import (
+    QUANTIZATIONS,
+    compile_inference,
+    export_onnx,
+    export_tflite,
+    load_labelled_images,
+)
+from api.utils.cnn_runtime import (
+    DATA_DETAILS_PATH,
+    KERAS_MODEL_PATH,
+    RUNTIME_BACKENDS,
+    load_runtime_model,
+    preprocess_image,
+    runtime_model_path,
+)
+
+dataset_folder = os.path.join("/persistent", "dataset", "clean")
+
+
+def export(model, data_details, args, output_path):
+    print(f"Exporting {args.model} to {output_path}")
+
+    calibration_images = None
+    if args.quantize == "int8" and args.backend == "tflite":
+        # Calibrate the activation ranges on a sample of the training images,
+        # the parity check skips them
+        calibration_images, _ = load_labelled_images(
+            args.images,
+            data_details["label2index"],
+            per_label=args.calibration_per_label,
+        )
+        print("Calibration images:", len(calibration_images))
+
+    if args.backend == "tflite":
+        export_tflite(model, output_path, args.quantize, calibration_images)
+    else:
+        export_onnx(model, output_path, args.quantize)
+
+    print(f"Exported model size: {os.path.getsize(output_path) / 1e6:.1f} MB")
+
+
+def parity(model, data_details, args, output_path):
+    print(f"Checking {output_path} against {args.model}")
+
+    if os.path.exists(args.images):
+        # Held out from the int8 calibration sample. The runtime backend gets the
+        # images through its own Pillow preprocessing, as the service does
+        images, labels = load_labelled_images(
+            args.images,
+            data_details["label2index"],
+            per_label=args.per_label,
+            skip=args.calibration_per_label,
+        )
+        runtime_images, _ = load_labelled_images(
+            args.images,
+            data_details["label2index"],
+            per_label=args.per_label,
+            skip=args.calibration_per_label,
+            preprocess=lambda image_bytes: preprocess_image(image_bytes, args.backend),
+        )
+    elif args.allow_random:
+        # Without the dataset only the agreement between the two models is checked
+        print(f"{args.images} not found, comparing on random images")
+        images = np.random.default_rng(0).random((64, 224, 224, 3), dtype=np.float32)
+        runtime_images = images
+        labels = None
+    else:
+        raise SystemExit(
+            f"{args.images} not found, pass --images or --allow-random to compare on random images"
+        )
+
+    keras_predict = compile_inference(model)
+    runtime_predict = load_runtime_model(args.backend, output_path)
+    keras_probabilities = np.concatenate(
+        [keras_predict(images[i : i + 16]) for i in range(0, len(images), 16)]
+    )
+    runtime_probabilities = np.concatenate(
+        [
+            runtime_predict(runtime_images[i : i + 16])
+            for i in range(0, len(runtime_images), 16)
+        ]
+    )
+
+    keras_labels = keras_probabilities.argmax(axis=1)
+    runtime_labels = runtime_probabilities.argmax(axis=1)
+    agreement = float(np.mean(keras_labels == runtime_labels))
+    print("Images:", len(images))
+    print(f"Top-1 agreement with keras: {agreement * 100:.2f}%")
+    print(
+        "Max probability difference:",
+        float(np.abs(keras_probabilities - runtime_probabilities).max()),
+    )
+    if agreement < args.min_agreement:
+        raise SystemExit(
+            f"{args.backend} agrees with keras on fewer than {args.min_agreement * 100:.1f}% of the images"
+        )
+    if labels is not None:
+        keras_accuracy = float(np.mean(keras_labels == labels))
+        runtime_accuracy = float(np.mean(runtime_labels == labels))
+        print(f"Accuracy keras: {keras_accuracy * 100:.2f}%")
+        print(f"Accuracy {args.backend}: {runtime_accuracy * 100:.2f}%")
+        if keras_accuracy - runtime_accuracy > args.max_accuracy_drop:
+            raise SystemExit(
+                f"{args.backend} accuracy is more than {args.max_accuracy_drop * 100:.1f}% below keras"
+            )
+
+
+def main(args):
+    if args.quantize and args.quantize not in QUANTIZATIONS[args.backend]:
+        raise SystemExit(
+            f"{args.backend} supports quantization {', '.join(QUANTIZATIONS[args.backend])}"
+        )
+
+    model = tf.keras.models.load_model(args.model)
+    with open(args.data_details, "r") as json_file:
+        data_details = json.load(json_file)
+    output_path = runtime_model_path(args.model, args.backend, args.quantize)
+
+    if args.export:
+        export(model, data_details, args, output_path)
+
+    if args.parity:
+        parity(model, data_details, args, output_path)
+
+
+if __name__ == "__main__":
+    # Generate the inputs arguments parser
+    # if you type into the terminal 'python cli.py --help', it will provide the description
+    parser = argparse.ArgumentParser(description="API Service CLI")
+
+    parser.add_argument(
+        "-e",
+        "--export",
+        action="store_true",
+        help="Export the CNN model for a lightweight inference runtime",
+    )
+    parser.add_argument(
+        "-p",
+        "--parity",
+        action="store_true",
+        help="Check the exported model predicts like the keras model",
+    )
+    parser.add_argument(
+        "--backend", choices=RUNTIME_BACKENDS, default="onnx", help="Runtime to export for"
+    )
+    parser.add_argument(
+        "--quantize",
+        choices=["", "float16", "int8"],
+        default="",
+        help="Quantise the exported model (tflite: float16, int8, onnx: int8)",
+    )
+    parser.add_argument("--model", default=KERAS_MODEL_PATH, help="Path to the .keras model")
+    parser.add_argument(
+        "--data-details", default=DATA_DETAILS_PATH, help="Path to data_details.json"
+    )
+    parser.add_argument(
+        "--images",
+        default=dataset_folder,
+        help="Labelled images, one folder per label, for the parity check and int8 calibration",
+    )
+    parser.add_argument(
+        "--per-label", type=int, default=50, help="Images per label for the parity check"
+    )
+    parser.add_argument(
+        "--calibration-per-label",
+        type=int,
+        default=20,
+        help="Images per label for the int8 calibration, the parity check skips them",
+    )
+    parser.add_argument(
+        "--allow-random",
+        action="store_true",
+        help="Compare on random images when the --images folder is missing",
+    )
+    parser.add_argument(
+        "--min-agreement",
+        type=float,
+        default=0.98,
+        help="Fail the parity check if top-1 agreement with keras is below this",
+    )
+    parser.add_argument(
+        "--max-accuracy-drop",
+        type=float,
+        default=0.01,
+        help="Fail the parity check if accuracy drops by more than this",
+    )
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from api.utils.chat_storage import FileChatStorage, atomic_write, dumps_json
+
+LEGACY_CHAT = {
+    "chat_id": "c1",
+    "title": "Brie...",
+    "dts": 1,
+    "messages": [
+        {"message_id": "m1", "role": "user", "content": "Brie?"},
+        {"message_id": "m2", "role": "assistant", "content": "A soft cheese."},
+    ],
+}
+
+
+def save_legacy_chat(history_dir):
+    """Save a chat the way it was stored before the message log existed"""
+    os.makedirs(os.path.join(history_dir, "s1"))
+    atomic_write(os.path.join(history_dir, "s1", "c1.json"), dumps_json(LEGACY_CHAT))
+
+
+def test_torn_legacy_migration_does_not_duplicate_messages(tmp_path):
+    save_legacy_chat(str(tmp_path))
+    storage = FileChatStorage(str(tmp_path))
+
+    # Crash after compaction wrote the message log, before it rewrote the header
+    def crash(chat, session_id):
+        raise OSError("crash")
+
+    storage._write_header = crash
+    with pytest.raises(OSError):
+        storage.append_messages(
+            "c1", "s1", [{"message_id": "m3", "role": "user", "content": "More"}], 2
+        )
+    assert os.path.exists(tmp_path / "s1" / "c1.jsonl")
+    assert "messages" in (tmp_path / "s1" / "c1.json").read_text()
+
+    storage = FileChatStorage(str(tmp_path))
+    assert storage.get_chat("c1", "s1")["messages"] == LEGACY_CHAT["messages"]
+
+    # The next append completes the migration
+    storage.append_messages(
+        "c1", "s1", [{"message_id": "m3", "role": "user", "content": "More"}], 2
+    )
+    chat = storage.get_chat("c1", "s1")
+    assert [message["message_id"] for message in chat["messages"]] == ["m1", "m2", "m3"]
+    assert chat["title"] == "Brie..."
+    assert "messages" not in (tmp_path / "s1" / "c1.json").read_text()
+
+
+def test_legacy_chat_without_log_reads_header_messages(tmp_path):
+    save_legacy_chat(str(tmp_path))
+    storage = FileChatStorage(str(tmp_path))
+    assert storage.get_chat("c1", "s1")["messages"] == LEGACY_CHAT["messages"]
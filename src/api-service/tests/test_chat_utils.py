@@ -0,0 +1,66 @@
+import asyncio
+
+from api.utils.chat_utils import stream_chat_response
+from api.utils.session_cache import ChatSessionCache
+
+
+class FailingChatManager:
+    """Chat manager whose storage layer fails on every write"""
+
+    async def save_chat(self, chat, session_id):
+        raise OSError("disk full")
+
+    async def append_messages(self, chat_id, session_id, messages, dts):
+        raise OSError("disk full")
+
+
+class FakeChatSession:
+    def get_history(self, curated=True):
+        return []
+
+
+async def fake_stream(chat_session, message):
+    for delta in ["Brie ", "is ", "soft."]:
+        yield delta
+
+
+def collect_events(chat, chat_sessions):
+    async def collect():
+        return [
+            event
+            async for event in stream_chat_response(
+                chat,
+                FakeChatSession(),
+                {"message_id": "m1", "role": "user", "content": "Brie?"},
+                "s1",
+                FailingChatManager(),
+                fake_stream,
+                chat_sessions,
+            )
+        ]
+
+    return [event.split("\n")[0] for event in asyncio.run(collect())]
+
+
+def test_stream_reports_failed_save_of_new_chat():
+    chat = {"chat_id": "c1", "title": "Brie?", "dts": 1, "messages": []}
+    chat_sessions = ChatSessionCache()
+    events = collect_events(chat, chat_sessions)
+    assert events[0] == "event: chat"
+    assert events[1:4] == ["event: delta"] * 3
+    assert events[-1] == "event: error"
+    assert "event: done" not in events
+    # The session of a chat that was never saved is not cached
+    assert "c1" not in chat_sessions
+
+
+def test_stream_reports_failed_append_to_existing_chat():
+    chat = {
+        "chat_id": "c1",
+        "title": "Brie?",
+        "dts": 1,
+        "messages": [{"message_id": "m0", "role": "user", "content": "Hi"}],
+    }
+    events = collect_events(chat, ChatSessionCache())
+    assert events[-1] == "event: error"
+    assert "event: done" not in events
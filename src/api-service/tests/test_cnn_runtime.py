@@ -0,0 +1,32 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from api.utils.cnn_runtime import decode_resize_image, preprocess_image
+
+
+def png_bytes(width, height, mode="RGB"):
+    shape = (height, width) if mode == "L" else (height, width, len(mode))
+    pixels = np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, mode).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize(
+    "width, height, mode",
+    [(640, 480, "RGB"), (150, 900, "RGB"), (100, 50, "RGBA"), (224, 224, "L")],
+)
+def test_runtime_preprocessing_matches_tensorflow(width, height, mode):
+    # PNG decodes identically, so only the resize and normalisation are compared
+    image_bytes = png_bytes(width, height, mode)
+    image = decode_resize_image(image_bytes)
+    assert image.shape == (224, 224, 3)
+    np.testing.assert_allclose(image, preprocess_image(image_bytes, "keras"), atol=1e-6)
+
+
+def test_undecodable_image_raises_value_error():
+    with pytest.raises(ValueError):
+        preprocess_image(b"not an image", "onnx")
@@ -0,0 +1,24 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from api.utils.http_cache import IMMUTABLE_CACHE_CONTROL, cached_file_response
+
+
+def test_cached_file_response_disables_content_sniffing(tmp_path):
+    path = tmp_path / "image"
+    path.write_bytes(b"<script>alert(1)</script>")
+    app = FastAPI()
+
+    @app.get("/image")
+    async def get_image(request: Request):
+        return cached_file_response(
+            request,
+            str(path),
+            media_type="application/octet-stream",
+            cache_control=IMMUTABLE_CACHE_CONTROL,
+        )
+
+    response = TestClient(app).get("/image")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/octet-stream"
+    assert response.headers["x-content-type-options"] == "nosniff"
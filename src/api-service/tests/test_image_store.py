@@ -0,0 +1,37 @@
+import io
+
+from PIL import Image
+
+from api.utils.image_store import ImageStore
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_image_type_is_sniffed_from_the_bytes(tmp_path):
+    store = ImageStore(str(tmp_path))
+    store.put("c1", "m1", png_bytes())
+    path, mime_type, _ = store.resolve("c1", "m1")
+    assert mime_type == "image/png"
+    assert path.endswith(".png")
+
+
+def test_non_image_is_stored_as_octet_stream(tmp_path):
+    store = ImageStore(str(tmp_path))
+    store.put("c1", "m1", b"<script>alert(1)</script>")
+    path, mime_type, _ = store.resolve("c1", "m1")
+    assert mime_type == "application/octet-stream"
+    assert not path.endswith(".html")
+
+
+def test_objects_stored_with_a_client_type_are_served_as_octet_stream(tmp_path):
+    store = ImageStore(str(tmp_path))
+    store.put("c1", "m1", png_bytes())
+    # As saved before types were sniffed, with the data URL's declared type
+    with store._conn:
+        store._conn.execute("UPDATE objects SET mime_type = 'text/html'")
+    _, mime_type, _ = store.resolve("c1", "m1")
+    assert mime_type == "application/octet-stream"
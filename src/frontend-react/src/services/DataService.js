@@ -37,7 +37,7 @@ const DataService = {
         return BASE_API_URL + "/podcasts/audio/" + audio_path;
     },
     GetNewsletters: async function (limit) {
-        return await api.get("/newsletters/?limit=" + limit);
+        return await api.get("/newsletters/?summary=true&limit=" + limit);
     },
     GetNewsletter: async function (newsletter_id) {
         return await api.get("/newsletters/" + newsletter_id);
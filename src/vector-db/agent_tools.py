@@ -2,6 +2,8 @@ import json
 from google import genai
 from google.genai import types
 
+from bm25_index import HybridRetriever
+
 # import vertexai
 # from vertexai.generative_models import FunctionDeclaration, Tool, Part
 
@@ -38,13 +40,22 @@ get_book_by_author_func = types.FunctionDeclaration(
 )
 
 
-def get_book_by_author(author, search_content, collection, embed_func):
+def query_chunks(collection, search_content, embed_func, **kwargs):
 
     query_embedding = embed_func(search_content)
 
+    if isinstance(collection, HybridRetriever):
+        # The hybrid retriever also ranks chunks by BM25 on the search text
+        kwargs["query_texts"] = [search_content]
+
     # Query based on embedding value
-    results = collection.query(
-        query_embeddings=[query_embedding], n_results=10, where={"author": author}
+    return collection.query(query_embeddings=[query_embedding], **kwargs)
+
+
+def get_book_by_author(author, search_content, collection, embed_func):
+
+    results = query_chunks(
+        collection, search_content, embed_func, n_results=10, where={"author": author}
     )
     return "\n".join(results["documents"][0])
 
@@ -68,10 +79,7 @@ get_book_by_search_content_func = types.FunctionDeclaration(
 
 def get_book_by_search_content(search_content, collection, embed_func):
 
-    query_embedding = embed_func(search_content)
-
-    # Query based on embedding value
-    results = collection.query(query_embeddings=[query_embedding], n_results=10)
+    results = query_chunks(collection, search_content, embed_func, n_results=10)
     return "\n".join(results["documents"][0])
 
 
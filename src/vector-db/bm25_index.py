@@ -0,0 +1,334 @@
+import glob
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from vector_index import (
+    MetadataFilter,
+    files_fingerprint,
+    iter_chunks,
+    read_records,
+    top_k,
+    write_records,
+)
+
+# Combine the vector results with BM25 keyword matches, see HybridRetriever
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "0").lower() in ("1", "true", "yes")
+# Candidates taken from each retriever before fusing the two rankings
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+# Reciprocal rank fusion constant, higher values flatten the weight of the top ranks
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# BM25 term frequency saturation and document length normalisation
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens, so "Tolminc" and "tolminc," match"""
+    return re.findall(r"\w+", unicodedata.normalize("NFKC", text).casefold())
+
+
+class BM25Index(MetadataFilter):
+    """
+    Inverted index over the chunk texts, ranking chunks with Okapi BM25.
+
+    The postings are stored CSR style: for the term with id t, the chunks containing
+    it are docs[offsets[t]:offsets[t + 1]] and weights holds their precomputed BM25
+    term weights, so scoring a query is one scatter-add per query term over only the
+    chunks that contain it.
+
+    query() takes query_texts and returns ids/documents/metadatas like
+    Collection.query, with the BM25 score of each chunk in scores. Chunks that share
+    no term with the query are never returned.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict],
+        vocabulary: List[str],
+        offsets: np.ndarray,
+        docs: np.ndarray,
+        weights: np.ndarray,
+        name: str = "bm25",
+        collection_id: Optional[str] = None,
+    ):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.vocabulary = vocabulary
+        self.term_ids = {term: term_id for term_id, term in enumerate(vocabulary)}
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+        self.name = name
+        self.collection_id = collection_id
+        super().__init__()
+
+    @classmethod
+    def build(
+        cls,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict],
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        **kwargs,
+    ) -> "BM25Index":
+        """Build the postings and BM25 weights for a list of chunks"""
+        term_counts = [Counter(tokenize(document)) for document in documents]
+        lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) else 0.0
+        # Length normalisation of each chunk, the denominator of the BM25 tf term
+        norms = k1 * (1 - b + b * lengths / (average_length or 1.0))
+
+        postings: Dict[str, List] = {}
+        for doc, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((doc, count))
+
+        vocabulary = sorted(postings)
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        docs = np.empty(sum(len(postings[term]) for term in vocabulary), dtype=np.int32)
+        weights = np.empty(len(docs), dtype=np.float32)
+        position = 0
+        for term_id, term in enumerate(vocabulary):
+            term_docs = np.array([doc for doc, _ in postings[term]], dtype=np.int32)
+            counts = np.array([count for _, count in postings[term]], dtype=np.float32)
+            idf = math.log(1 + (len(documents) - len(term_docs) + 0.5) / (len(term_docs) + 0.5))
+            end = position + len(term_docs)
+            docs[position:end] = term_docs
+            weights[position:end] = idf * counts * (k1 + 1) / (counts + norms[term_docs])
+            offsets[term_id + 1] = end
+            position = end
+
+        return cls(ids, documents, metadatas, vocabulary, offsets, docs, weights, **kwargs)
+
+    @classmethod
+    def from_jsonl(
+        cls,
+        folder: str,
+        method: str,
+        book_metadata: Optional[Dict[str, Dict]] = None,
+    ) -> "BM25Index":
+        """
+        Build the index from the chunks-<method>-*.jsonl files, with the same chunk ids
+        and metadata as the vector db.
+        """
+        jsonl_files = sorted(glob.glob(os.path.join(folder, f"chunks-{method}-*.jsonl")))
+        if not jsonl_files:
+            raise FileNotFoundError(f"No chunks-{method}-*.jsonl files in {folder}")
+
+        ids, documents, metadatas = [], [], []
+        for id, metadata, record in iter_chunks(jsonl_files, book_metadata):
+            ids.append(id)
+            documents.append(record["chunk"])
+            metadatas.append(metadata)
+
+        return cls.build(
+            ids,
+            documents,
+            metadatas,
+            name=f"{method}-bm25",
+            collection_id=files_fingerprint(jsonl_files),
+        )
+
+    @staticmethod
+    def index_paths(folder: str, method: str):
+        """Paths of the postings and the records of a saved index"""
+        return (
+            os.path.join(folder, f"bm25-{method}.npz"),
+            os.path.join(folder, f"bm25-{method}.jsonl"),
+        )
+
+    def save(self, folder: str, method: str) -> None:
+        """Save the index so it can be loaded without re-tokenising the chunks"""
+        os.makedirs(folder, exist_ok=True)
+        postings_path, records_path = self.index_paths(folder, method)
+        # Write next to the final files and rename, a reader never sees a partial index
+        write_records(records_path + ".tmp", self.ids, self.documents, self.metadatas)
+        with open(postings_path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                vocabulary=np.array(self.vocabulary, dtype=str),
+                offsets=self.offsets,
+                docs=self.docs,
+                weights=self.weights,
+            )
+        os.replace(records_path + ".tmp", records_path)
+        os.replace(postings_path + ".tmp", postings_path)
+
+    @classmethod
+    def load(cls, folder: str, method: str) -> "BM25Index":
+        """Load an index saved with save()"""
+        postings_path, records_path = cls.index_paths(folder, method)
+        ids, documents, metadatas = read_records(records_path)
+        with np.load(postings_path) as postings:
+            return cls(
+                ids,
+                documents,
+                metadatas,
+                postings["vocabulary"].tolist(),
+                postings["offsets"],
+                postings["docs"],
+                postings["weights"],
+                name=f"{method}-bm25",
+                collection_id=files_fingerprint([postings_path, records_path]),
+            )
+
+    @classmethod
+    def open(
+        cls,
+        folder: str,
+        method: str,
+        book_metadata: Optional[Dict[str, Dict]] = None,
+    ) -> "BM25Index":
+        """Load the saved index if there is one, else build it from the chunk files"""
+        postings_path, records_path = cls.index_paths(folder, method)
+        if os.path.exists(postings_path) and os.path.exists(records_path):
+            index = cls.load(folder, method)
+        else:
+            index = cls.from_jsonl(folder, method, book_metadata=book_metadata)
+        print(f"Loaded BM25 index {index.name}: {index.count()} chunks, {len(index.vocabulary)} terms")
+        return index
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def scores(self, text: str) -> np.ndarray:
+        """BM25 score of every chunk for a query"""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(text)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # A chunk appears once per term, so a plain fancy-indexed add is exact
+            scores[self.docs[start:end]] += self.weights[start:end]
+        return scores
+
+    def query(
+        self,
+        query_texts,
+        n_results: int = 10,
+        where: Optional[Dict] = None,
+        where_document: Optional[Dict] = None,
+        **kwargs,
+    ) -> Dict:
+        """Top n_results chunks by BM25 score for each query text"""
+        if isinstance(query_texts, str):
+            query_texts = [query_texts]
+        mask = self.filter_mask(where, where_document)
+
+        results = {"ids": [], "documents": [], "metadatas": [], "scores": []}
+        for text in query_texts:
+            scores = self.scores(text)
+            if mask is not None:
+                scores[~mask] = 0.0
+            top = top_k(scores, min(n_results, int(np.count_nonzero(scores))))
+            results["ids"].append([self.ids[i] for i in top])
+            results["documents"].append([self.documents[i] for i in top])
+            results["metadatas"].append([self.metadatas[i] for i in top])
+            results["scores"].append(scores[top].tolist())
+        return results
+
+
+class HybridRetriever:
+    """
+    Vector search fused with BM25 keyword search by reciprocal rank fusion.
+
+    Each retriever returns its top candidates chunks, and every chunk is scored
+    sum(1 / (rrf_k + rank)) over the rankings it appears in, so a chunk that is an
+    exact keyword match for a rare name ("Tolminc") surfaces even when its embedding
+    is not among the nearest ones.
+
+    vector is anything with a Collection.query interface (a chroma collection, a
+    CollectionHandle or a LocalVectorIndex). query() takes the query embeddings and
+    the query texts, and returns ids/documents/metadatas/distances like
+    Collection.query, with the fused scores in scores. The distance is the vector
+    distance, None for chunks found only by BM25.
+    """
+
+    def __init__(
+        self,
+        vector,
+        lexical: BM25Index,
+        candidates: int = HYBRID_CANDIDATES,
+        rrf_k: int = RRF_K,
+    ):
+        self.vector = vector
+        self.lexical = lexical
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+
+    @property
+    def collection_id(self) -> Optional[str]:
+        """Changes when either index is reloaded"""
+        vector_id = getattr(self.vector, "collection_id", None)
+        if vector_id is None:
+            return None
+        return f"{vector_id}+{self.lexical.collection_id}"
+
+    def query(
+        self,
+        query_embeddings,
+        query_texts,
+        n_results: int = 10,
+        where: Optional[Dict] = None,
+        where_document: Optional[Dict] = None,
+    ) -> Dict:
+        """Top n_results chunks by fused rank for each query embedding and text"""
+        if isinstance(query_texts, str):
+            query_texts = [query_texts]
+        candidates = max(self.candidates, n_results)
+        filters = {}
+        if where:
+            filters["where"] = where
+        if where_document:
+            filters["where_document"] = where_document
+
+        vector_results = self.vector.query(
+            query_embeddings=query_embeddings, n_results=candidates, **filters
+        )
+        lexical_results = self.lexical.query(
+            query_texts=query_texts, n_results=candidates, **filters
+        )
+
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": [], "scores": []}
+        for i in range(len(query_texts)):
+            scores: Dict[str, float] = {}
+            chunks: Dict[str, tuple] = {}
+            distances: Dict[str, float] = {}
+            for ranked in (vector_results, lexical_results):
+                for rank, id in enumerate(ranked["ids"][i], start=1):
+                    scores[id] = scores.get(id, 0.0) + 1.0 / (self.rrf_k + rank)
+                    chunks.setdefault(
+                        id, (ranked["documents"][i][rank - 1], ranked["metadatas"][i][rank - 1])
+                    )
+            if vector_results.get("distances"):
+                distances = dict(zip(vector_results["ids"][i], vector_results["distances"][i]))
+
+            top = sorted(scores, key=scores.get, reverse=True)[:n_results]
+            results["ids"].append(top)
+            results["documents"].append([chunks[id][0] for id in top])
+            results["metadatas"].append([chunks[id][1] for id in top])
+            results["distances"].append([distances.get(id) for id in top])
+            results["scores"].append([scores[id] for id in top])
+        return results
+
+    def health(self) -> Dict:
+        health = self.vector.health() if hasattr(self.vector, "health") else {"healthy": True}
+        health["bm25"] = {
+            "collection": self.lexical.name,
+            "collection_id": self.lexical.collection_id,
+            "count": self.lexical.count(),
+            "terms": len(self.lexical.vocabulary),
+        }
+        return health
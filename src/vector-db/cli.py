@@ -20,6 +20,9 @@ from google.genai import errors
 from langchain.text_splitter import CharacterTextSplitter
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from semantic_splitter import SemanticChunker
+from embedding_cache import EmbeddingCache
+from vector_index import LocalVectorIndex, RETRIEVAL_BACKEND
+from bm25_index import BM25Index, HybridRetriever, HYBRID_RETRIEVAL
 import agent_tools
 
 # Setup
@@ -76,7 +79,18 @@ book_mappings = {
 }
 
 
+# Cache of query embeddings, shared by queries and the agent tools, kept on disk across runs
+query_embedding_cache = EmbeddingCache(
+    db_path=os.getenv("EMBEDDING_CACHE_DB", os.path.join(OUTPUT_FOLDER, "query-embeddings.db"))
+)
+
+
 def generate_query_embedding(query):
+    # Repeated questions reuse the embedding instead of calling Vertex AI again
+    cached = query_embedding_cache.get(query, EMBEDDING_MODEL, EMBEDDING_DIMENSION)
+    if cached is not None:
+        return cached
+
     kwargs = {
         "output_dimensionality": EMBEDDING_DIMENSION
     }
@@ -85,7 +99,9 @@ def generate_query_embedding(query):
         contents=query,
         config=types.EmbedContentConfig(**kwargs)
     )
-    return response.embeddings[0].values
+    embedding = response.embeddings[0].values
+    query_embedding_cache.put(query, EMBEDDING_MODEL, EMBEDDING_DIMENSION, embedding)
+    return embedding
 
 
 def generate_text_embeddings(chunks, dimensionality: int = 256, batch_size=250, max_retries=5, retry_delay=5):
@@ -309,22 +325,43 @@ def load(method="char-split"):
         # Load data
         load_text_embeddings(data_df, collection)
 
+    # Save the same chunks as a local vector index, used when RETRIEVAL_BACKEND=local
+    index = LocalVectorIndex.from_jsonl(OUTPUT_FOLDER, method, book_metadata=book_mappings)
+    index.save(OUTPUT_FOLDER, method)
+    print(f"Saved local vector index with {index.count()} chunks to {OUTPUT_FOLDER}")
 
-def query(method="char-split"):
-    print("load()")
+    # Build the BM25 keyword index over the chunks, used when HYBRID_RETRIEVAL=1
+    bm25 = BM25Index.from_jsonl(OUTPUT_FOLDER, method, book_metadata=book_mappings)
+    bm25.save(OUTPUT_FOLDER, method)
+    print(f"Saved BM25 index with {bm25.count()} chunks and {len(bm25.vocabulary)} terms to {OUTPUT_FOLDER}")
 
-    # Connect to chroma DB
-    client = chromadb.HttpClient(host=CHROMADB_HOST, port=CHROMADB_PORT)
 
-    # Get a collection object from an existing collection, by name. If it doesn't exist, create it.
-    collection_name = f"{method}-collection"
+def get_collection(method="char-split"):
+    # Search the local vector index in process, or the chroma collection
+    if RETRIEVAL_BACKEND == "local":
+        collection = LocalVectorIndex.open(OUTPUT_FOLDER, method, book_metadata=book_mappings)
+    else:
+        # Connect to chroma DB
+        client = chromadb.HttpClient(host=CHROMADB_HOST, port=CHROMADB_PORT)
+        collection_name = f"{method}-collection"
+        collection = client.get_collection(name=collection_name)
+
+    if HYBRID_RETRIEVAL:
+        # Fuse the vector results with BM25 keyword matches
+        bm25 = BM25Index.open(OUTPUT_FOLDER, method, book_metadata=book_mappings)
+        collection = HybridRetriever(collection, bm25)
+    return collection
+
+
+def query(method="char-split"):
+    print("load()")
 
     query = "How is tolminc cheese made?"
     query_embedding = generate_query_embedding(query)
     print("Embedding values:", query_embedding)
 
     # Get the collection
-    collection = client.get_collection(name=collection_name)
+    collection = get_collection(method)
 
     # # 1: Query based on embedding value
     # results = collection.query(
@@ -355,8 +392,10 @@ def query(method="char-split"):
 
     # 4: Query based on embedding value + lexical search filter
     search_string = "Italian"
-    results = collection.query(
-        query_embeddings=[query_embedding],
+    results = agent_tools.query_chunks(
+        collection,
+        query,
+        generate_query_embedding,
         n_results=10,
         where={"book": "The Complete Book of Cheese"},
         where_document={"$contains": search_string}
@@ -426,12 +465,8 @@ def get(method="char-split"):
 def agent(method="char-split"):
 	print("agent()")
 
-	# Connect to chroma DB
-	client = chromadb.HttpClient(host=CHROMADB_HOST, port=CHROMADB_PORT)
-	# Get a collection object from an existing collection, by name. If it doesn't exist, create it.
-	collection_name = f"{method}-collection"
-	# Get the collection
-	collection = client.get_collection(name=collection_name)
+	# Get the collection, the agent tools query it like a chroma collection
+	collection = get_collection(method)
 
 	# User prompt
 	user_prompt_content = Content(
@@ -475,6 +510,8 @@ def agent(method="char-split"):
 		)
 		print("LLM Response:", response)
 
+	print("Query embedding cache:", query_embedding_cache.stats())
+
 
 def download():
 	print("download()")
@@ -0,0 +1,334 @@
+import glob
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from functools import reduce
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Where chunks are retrieved from: "chroma" (the vector db server) or "local"
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "chroma").lower()
+# Folder with the chunks-/embeddings-<method>-*.jsonl files from vector-db/cli.py,
+# or the index-<method> and bm25-<method> files saved by vector-db/cli.py --load
+VECTOR_INDEX_FOLDER = os.getenv("VECTOR_INDEX_FOLDER", "/persistent/vector-index")
+# Memory-map a saved index instead of reading it into memory
+VECTOR_INDEX_MMAP = os.getenv("VECTOR_INDEX_MMAP", "1").lower() in ("1", "true", "yes")
+
+# Metadata filter masks kept per where clause
+MAX_CACHED_MASKS = 64
+
+
+def chunk_id(book: str, index: int) -> str:
+    """Id of a chunk, the same as the ids vector-db/cli.py loads into chroma"""
+    return hashlib.sha256(book.encode()).hexdigest()[:16] + "-" + str(index)
+
+
+def files_fingerprint(paths: Sequence[str]) -> str:
+    """Id of an index that changes when any of its files is rewritten"""
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:32]
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def iter_chunks(jsonl_files: Sequence[str], book_metadata: Optional[Dict[str, Dict]] = None):
+    """
+    Read the chunks of the chunks-/embeddings-<method>-<book>.jsonl files written by
+    vector-db/cli.py, yielding (id, metadata, record) with the ids and metadata it
+    loads into chroma. book_metadata maps a book to extra metadata (author, year).
+    """
+    for jsonl_file in jsonl_files:
+        with open(jsonl_file) as f:
+            for index, line in enumerate(line for line in f if line.strip()):
+                record = json.loads(line)
+                book = record["book"]
+                metadata = {"book": book}
+                if book_metadata and book in book_metadata:
+                    metadata.update(book_metadata[book])
+                yield chunk_id(book, index), metadata, record
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, highest first"""
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def write_records(path: str, ids: List[str], documents: List[str], metadatas: List[Dict]) -> None:
+    """Write the chunks of an index as JSONL, one id/document/metadata record per line"""
+    with open(path, "w") as f:
+        for id, document, metadata in zip(ids, documents, metadatas):
+            f.write(json.dumps({"id": id, "document": document, "metadata": metadata}) + "\n")
+
+
+def read_records(path: str):
+    """Read the chunks written by write_records, as lists of ids, documents and metadatas"""
+    ids, documents, metadatas = [], [], []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            ids.append(record["id"])
+            documents.append(record["document"])
+            metadatas.append(record["metadata"])
+    return ids, documents, metadatas
+
+
+class MetadataFilter:
+    """
+    Chroma style where and where_document filters over the chunks of an index,
+    evaluated as boolean masks. Subclasses set ids, documents and metadatas.
+
+    Metadata filters (where) support equality, $eq, $ne, $in, $nin, $and and $or,
+    and document filters (where_document) support $contains and $not_contains.
+    """
+
+    ids: List[str]
+    documents: List[str]
+    metadatas: List[Dict]
+
+    def __init__(self):
+        self._columns: Dict[str, np.ndarray] = {}
+        self._masks: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+    def _column(self, key: str) -> np.ndarray:
+        column = self._columns.get(key)
+        if column is None:
+            column = np.empty(len(self.metadatas), dtype=object)
+            column[:] = [metadata.get(key) for metadata in self.metadatas]
+            self._columns[key] = column
+        return column
+
+    def _where_mask(self, where: Dict) -> np.ndarray:
+        masks = []
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                combine = np.logical_and if key == "$and" else np.logical_or
+                masks.append(reduce(combine, [self._where_mask(clause) for clause in condition]))
+                continue
+
+            column = self._column(key)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, value in condition.items():
+                if operator == "$eq":
+                    masks.append(column == value)
+                elif operator == "$ne":
+                    masks.append(column != value)
+                elif operator in ("$in", "$nin"):
+                    mask = reduce(
+                        np.logical_or,
+                        [column == item for item in value],
+                        np.zeros(len(column), dtype=bool),
+                    )
+                    masks.append(mask if operator == "$in" else ~mask)
+                else:
+                    raise ValueError(f"Unsupported where operator {operator}")
+
+        return reduce(np.logical_and, masks, np.ones(len(self.ids), dtype=bool))
+
+    def _document_mask(self, where_document: Dict) -> np.ndarray:
+        masks = []
+        for operator, value in where_document.items():
+            if operator in ("$contains", "$not_contains"):
+                mask = np.fromiter(
+                    (value in document for document in self.documents),
+                    dtype=bool,
+                    count=len(self.documents),
+                )
+                masks.append(mask if operator == "$contains" else ~mask)
+            else:
+                raise ValueError(f"Unsupported where_document operator {operator}")
+
+        return reduce(np.logical_and, masks, np.ones(len(self.ids), dtype=bool))
+
+    def filter_mask(self, where: Optional[Dict] = None, where_document: Optional[Dict] = None):
+        """Rows matching the filters, None when there is no filter"""
+        if not where and not where_document:
+            return None
+
+        key = json.dumps([where, where_document], sort_keys=True)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = np.ones(len(self.ids), dtype=bool)
+            if where:
+                mask &= self._where_mask(where)
+            if where_document:
+                mask &= self._document_mask(where_document)
+            self._masks[key] = mask
+            while len(self._masks) > MAX_CACHED_MASKS:
+                self._masks.popitem(last=False)
+        return mask
+
+
+class LocalVectorIndex(MetadataFilter):
+    """
+    In-process vector index, a drop-in for a chroma collection when retrieving chunks.
+
+    The chunk embeddings are kept L2-normalised in one contiguous float32 matrix,
+    so cosine similarity to every chunk is a single matrix-vector product and the
+    top-k is an argpartition. query() takes the same arguments and returns the same
+    ids/documents/metadatas/distances as Collection.query, with the ids chroma uses.
+
+    The index is read-only once built, so it can be queried from several threads.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict],
+        embeddings: np.ndarray,
+        name: str = "local",
+        collection_id: Optional[str] = None,
+    ):
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(ids):
+            raise ValueError(
+                f"Expected {len(ids)} embeddings, got an array of shape {embeddings.shape}"
+            )
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        # A memory-mapped matrix is already normalised and contiguous, keep it mapped
+        if not isinstance(embeddings, np.memmap):
+            embeddings = np.ascontiguousarray(
+                _normalize_rows(embeddings.astype(np.float32, copy=False))
+            )
+        self.embeddings = embeddings
+        self.name = name
+        self.collection_id = collection_id
+        super().__init__()
+
+    @classmethod
+    def from_jsonl(
+        cls,
+        folder: str,
+        method: str,
+        book_metadata: Optional[Dict[str, Dict]] = None,
+    ) -> "LocalVectorIndex":
+        """
+        Build the index from the embeddings-<method>-*.jsonl files, with book_metadata
+        mapping a book to the extra metadata (author, year) stored with its chunks.
+        """
+        jsonl_files = sorted(glob.glob(os.path.join(folder, f"embeddings-{method}-*.jsonl")))
+        if not jsonl_files:
+            raise FileNotFoundError(f"No embeddings-{method}-*.jsonl files in {folder}")
+
+        ids, documents, metadatas, vectors = [], [], [], []
+        for id, metadata, record in iter_chunks(jsonl_files, book_metadata):
+            ids.append(id)
+            documents.append(record["chunk"])
+            metadatas.append(metadata)
+            vectors.append(record["embedding"])
+
+        return cls(
+            ids,
+            documents,
+            metadatas,
+            np.array(vectors, dtype=np.float32),
+            name=f"{method}-local",
+            collection_id=files_fingerprint(jsonl_files),
+        )
+
+    @staticmethod
+    def index_paths(folder: str, method: str):
+        """Paths of the matrix and the records of a saved index"""
+        return (
+            os.path.join(folder, f"index-{method}.npy"),
+            os.path.join(folder, f"index-{method}.jsonl"),
+        )
+
+    def save(self, folder: str, method: str) -> None:
+        """Save the index so it can be loaded (and memory-mapped) without re-parsing"""
+        os.makedirs(folder, exist_ok=True)
+        matrix_path, records_path = self.index_paths(folder, method)
+        # Write next to the final files and rename, a reader never sees a partial index
+        write_records(records_path + ".tmp", self.ids, self.documents, self.metadatas)
+        with open(matrix_path + ".tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(self.embeddings))
+        os.replace(records_path + ".tmp", records_path)
+        os.replace(matrix_path + ".tmp", matrix_path)
+
+    @classmethod
+    def load(cls, folder: str, method: str, mmap: bool = VECTOR_INDEX_MMAP) -> "LocalVectorIndex":
+        """Load an index saved with save(), memory-mapping the matrix if mmap is set"""
+        matrix_path, records_path = cls.index_paths(folder, method)
+        ids, documents, metadatas = read_records(records_path)
+        embeddings = np.load(matrix_path, mmap_mode="r" if mmap else None)
+
+        return cls(
+            ids,
+            documents,
+            metadatas,
+            embeddings,
+            name=f"{method}-local",
+            collection_id=files_fingerprint([matrix_path, records_path]),
+        )
+
+    @classmethod
+    def open(
+        cls,
+        folder: str,
+        method: str,
+        book_metadata: Optional[Dict[str, Dict]] = None,
+        mmap: bool = VECTOR_INDEX_MMAP,
+    ) -> "LocalVectorIndex":
+        """Load the saved index if there is one, else build it from the embeddings files"""
+        matrix_path, records_path = cls.index_paths(folder, method)
+        if os.path.exists(matrix_path) and os.path.exists(records_path):
+            index = cls.load(folder, method, mmap=mmap)
+        else:
+            index = cls.from_jsonl(folder, method, book_metadata=book_metadata)
+        print(f"Loaded local vector index {index.name}: {index.count()} chunks")
+        return index
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def query(
+        self,
+        query_embeddings,
+        n_results: int = 10,
+        where: Optional[Dict] = None,
+        where_document: Optional[Dict] = None,
+        **kwargs,
+    ) -> Dict:
+        """Top n_results chunks by cosine distance for each query embedding"""
+        queries = _normalize_rows(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        scores = queries @ self.embeddings.T
+
+        mask = self.filter_mask(where, where_document)
+        candidates = len(self.ids)
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+            candidates = int(mask.sum())
+
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        k = min(n_results, candidates)
+        for row in scores:
+            top = top_k(row, k)
+            results["ids"].append([self.ids[i] for i in top])
+            results["documents"].append([self.documents[i] for i in top])
+            results["metadatas"].append([self.metadatas[i] for i in top])
+            results["distances"].append((1.0 - row[top]).tolist())
+        return results
+
+    def health(self) -> Dict:
+        return {
+            "healthy": True,
+            "backend": "local",
+            "collection": self.name,
+            "collection_id": self.collection_id,
+            "count": self.count(),
+            "memory_mapped": isinstance(self.embeddings, np.memmap),
+        }